@@ -5,3 +5,9 @@ from django.apps import AppConfig
 
 class PeeringConfig(AppConfig):
     name = 'peering'
+
+    def ready(self):
+        from django.core import checks
+        from .statistics import check_cache, connect_signals
+        checks.register(check_cache, deploy=True)
+        connect_signals()
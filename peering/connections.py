@@ -0,0 +1,277 @@
+from __future__ import unicode_literals
+
+import logging
+import math
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+
+class NapalmConnectionPool(object):
+    """
+    Keeps NAPALM connections opened to the routers so that they can be reused
+    instead of going through the whole connection process each time a router
+    has to be queried.
+
+    A connection which has not been used for more than the idle timeout is
+    closed, by a background thread running while connections are idle so that
+    routers do not keep sessions (and locks) of a long-lived process. A
+    connection is checked with is_alive() before being reused, and is only
+    reused by callers asking for the timeout it was opened with, as NAPALM
+    drivers apply their timeout when opening connections. A router is never
+    used by more than a given number of connections at the
+    same time, callers wait for a connection to be released when this limit
+    is reached.
+    """
+    logger = logging.getLogger('peering.manager.napalm')
+
+    def __init__(self, idle_timeout=60, max_connections=2, wait_timeout=30):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self.lock = threading.Lock()
+        # Idle connections by router and timeout, semaphores limiting the
+        # number of connections in use by router
+        self.idle = {}
+        self.semaphores = {}
+        self.reaper = None
+
+    def _get_key(self, router):
+        # A router with a changed hostname or platform needs new connections
+        return (router.pk, router.hostname, router.platform)
+
+    def _close(self, router, device):
+        try:
+            router.close_napalm_device(device)
+        except Exception:
+            self.logger.debug('error while closing connection with %s',
+                              router.hostname)
+
+    def _is_alive(self, device):
+        try:
+            return device.is_alive().get('is_alive', False)
+        except Exception:
+            return False
+
+    def _pop_expired(self):
+        """
+        Removes the connections which have been idle for too long from the
+        pool and returns them along with their routers.
+        """
+        now = time.time()
+        expired = []
+
+        for key in list(self.idle):
+            connections = []
+            for router, device, last_used in self.idle[key]:
+                if now - last_used > self.idle_timeout:
+                    expired.append((router, device))
+                else:
+                    connections.append((router, device, last_used))
+            self.idle[key] = connections
+
+        return expired
+
+    def close_expired(self):
+        """
+        Closes the connections which have been idle for too long.
+        """
+        with self.lock:
+            expired = self._pop_expired()
+
+        # Closing connections can take some time, do it without the lock
+        for router, device in expired:
+            self.logger.debug('closing idle connection with %s',
+                              router.hostname)
+            self._close(router, device)
+
+    def _reap(self):
+        while True:
+            with self.lock:
+                last_used = [last_used
+                             for connections in self.idle.values()
+                             for _, _, last_used in connections]
+                # Nothing left to close, a new thread is started by the next
+                # released connection
+                if not last_used:
+                    self.reaper = None
+                    return
+                delay = min(last_used) + self.idle_timeout - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+            self.close_expired()
+
+    def _start_reaper(self):
+        # Must be called with the lock held
+        if self.reaper is None:
+            self.reaper = threading.Thread(target=self._reap,
+                                           name='napalm-pool-reaper')
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    def _acquire(self, router, timeout):
+        key = self._get_key(router)
+        idle_key = (key, timeout)
+
+        self.close_expired()
+        with self.lock:
+            semaphore = self.semaphores.setdefault(
+                key, threading.BoundedSemaphore(self.max_connections))
+
+        if not semaphore.acquire(timeout=self.wait_timeout):
+            self.logger.error('no connection available for %s after %s '
+                              'seconds', router.hostname, self.wait_timeout)
+            return None
+
+        try:
+            # Reuse the most recently used connection that is still alive
+            while True:
+                with self.lock:
+                    connections = self.idle.get(idle_key)
+                    if not connections:
+                        break
+                    _, device, _ = connections.pop()
+
+                if self._is_alive(device):
+                    self.logger.debug('reusing connection with %s',
+                                      router.hostname)
+                    return device
+
+                self.logger.debug('dropping dead connection with %s',
+                                  router.hostname)
+                self._close(router, device)
+
+            device = router.get_napalm_device(timeout=timeout)
+            if router.open_napalm_device(device):
+                return device
+        except Exception:
+            semaphore.release()
+            raise
+
+        semaphore.release()
+        return None
+
+    def _release(self, router, device, timeout, reusable):
+        key = self._get_key(router)
+
+        if reusable and self.idle_timeout > 0:
+            with self.lock:
+                self.idle.setdefault((key, timeout), []).append(
+                    (router, device, time.time()))
+                self._start_reaper()
+        else:
+            self._close(router, device)
+
+        self.semaphores[key].release()
+        self.close_expired()
+
+    @contextmanager
+    def connection(self, router, timeout=None):
+        """
+        Yields an opened NAPALM device for the given router, or None if no
+        connection could be made. The device goes back to the pool once done
+        with it, unless an exception was raised while using it.
+        """
+        device = self._acquire(router, timeout)
+        if not device:
+            yield None
+            return
+
+        try:
+            yield device
+        except Exception:
+            self._release(router, device, timeout, False)
+            raise
+        else:
+            self._release(router, device, timeout, True)
+
+    def close_all(self):
+        """
+        Closes all idle connections.
+        """
+        with self.lock:
+            connections = [(router, device)
+                           for connections in self.idle.values()
+                           for router, device, _ in connections]
+            self.idle = {}
+
+        for router, device in connections:
+            self._close(router, device)
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """
+    Returns the NAPALM connection pool shared by the whole process, creating
+    it on first use based on the settings.
+    """
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if not _connection_pool:
+            _connection_pool = NapalmConnectionPool(
+                idle_timeout=settings.NAPALM_POOL_IDLE_TIMEOUT,
+                max_connections=settings.NAPALM_POOL_MAX_CONNECTIONS,
+                wait_timeout=settings.NAPALM_TIMEOUT)
+
+    return _connection_pool
+
+
+def call_on_routers(function, routers, workers=4, timeout=None):
+    """
+    Calls the given function with each router, using at most the given number
+    of threads at the same time. Returns a dict mapping the routers to the
+    returned values and the list of routers the function is still running for
+    after twice the timeout (defaulting to the NAPALM_TIMEOUT setting) for
+    each round of routers. The values of these routers are None.
+
+    Threads running the function cannot be stopped, exit_abandoning_routers()
+    must be used instead of returning normally when routers are stuck.
+    """
+    def call(router):
+        try:
+            return function(router)
+        finally:
+            # Each thread gets its own database connection
+            connection.close()
+
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {router: executor.submit(call, router) for router in routers}
+
+    timeout = timeout or settings.NAPALM_TIMEOUT
+    _, not_done = wait(futures.values(), timeout=2 * timeout * math.ceil(
+        len(futures) / workers))
+    executor.shutdown(wait=False)
+
+    results = {}
+    stuck = []
+    for router, future in futures.items():
+        results[router] = None
+        if future not in not_done:
+            results[router] = future.result()
+        elif not future.cancel():
+            stuck.append(router)
+
+    return results, stuck
+
+
+def exit_abandoning_routers(routers, logger):
+    """
+    Exits the process without waiting for the threads still talking to the
+    given routers, the interpreter would wait for them forever otherwise.
+    """
+    logger.error('giving up on %s, exiting',
+                 ', '.join([router.hostname for router in routers]))
+    logging.shutdown()
+    os._exit(1)
@@ -4,6 +4,8 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+from peering.connections import (call_on_routers, exit_abandoning_routers,
+                                 get_connection_pool)
 from peering.models import InternetExchange
 
 
@@ -12,19 +14,102 @@ class Command(BaseCommand):
             ' template attached.')
     logger = logging.getLogger('peering.manager.peering')
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Maximum number of routers configured at the same time.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Deploy configurations even if they have not changed since '
+                 'their last deployment.')
+        parser.add_argument(
+            '--timeout', type=int,
+            help='Timeout in seconds used to talk to each router (defaults to '
+                 'the NAPALM_TIMEOUT setting).')
+
+    @staticmethod
+    def join_configurations(configurations):
+        """
+        Yields the chunks of several configurations, separated by new lines.
+        """
+        for i, configuration in enumerate(configurations):
+            if i > 0:
+                yield '\n'
+            for chunk in configuration:
+                yield chunk
+
+    def deploy(self, router, configuration, timeout):
+        try:
+            return router.set_napalm_configuration(configuration, commit=True,
+                                                   timeout=timeout)
+        except Exception:
+            self.logger.exception('error while deploying configuration on %s',
+                                  router.hostname)
+            return None
+
     def handle(self, *args, **options):
         self.logger.info('Deploying configurations...')
 
-        for ix in InternetExchange.objects.all():
+        # Group configurations by router, so each router gets a single
+        # candidate configuration
+        routers = {}
+        internet_exchanges = InternetExchange.objects.select_related(
+            'configuration_template', 'router')
+        for ix in internet_exchanges:
             # Only deploy config if there are at least a configuration
             # template, a router and a platform for the router
             if ix.configuration_template and ix.router and ix.router.platform:
+                # Rendered while being sent to the router
+                configuration = ix.generate_configuration_stream()
+
+                # Nothing changed since the last successful deployment
+                if not options['force'] and ix.is_configuration_deployed():
+                    self.logger.info(
+                        'Configuration unchanged on {}'.format(ix.name))
+                    continue
+
                 self.logger.info(
                     'Deploying configuration on {}'.format(ix.name))
-                ix.router.set_napalm_configuration(ix.generate_configuration(),
-                                                   commit=True)
+                _, ixs, configurations = routers.setdefault(
+                    ix.router.pk, (ix.router, [], []))
+                ixs.append(ix)
+                configurations.append(configuration)
             else:
                 self.logger.info(
                     'No configuration to deploy on {}'.format(ix.name))
 
-        self.logger.info('Configurations deployed')
+        # Configurations are rendered by the threads, while being sent to the
+        # routers, a router which does not answer must not block the others
+        configurations = {
+            router: self.join_configurations(router_configurations)
+            for router, _, router_configurations in routers.values()
+        }
+        results, stuck = call_on_routers(
+            lambda router: self.deploy(router, configurations[router],
+                                       options['timeout']),
+            configurations, workers=options['workers'],
+            timeout=options['timeout'])
+
+        # Summary of what happened on each router
+        failed = 0
+        for router, ixs, _ in routers.values():
+            changes = results[router]
+            if changes is None:
+                failed += 1
+                result = 'failed'
+            else:
+                result = 'changed' if changes else 'unchanged'
+                for ix in ixs:
+                    ix.set_configuration_deployed()
+
+            self.stdout.write('{}: {} ({})'.format(
+                router.name, result, ', '.join([ix.name for ix in ixs])))
+
+        self.logger.info('Configurations deployed on {} routers ({} '
+                         'failed)'.format(len(routers) - failed, failed))
+
+        if stuck:
+            exit_abandoning_routers(stuck, self.logger)
+
+        # No need to keep connections opened once the command is done
+        get_connection_pool().close_all()
@@ -3,7 +3,10 @@ from __future__ import unicode_literals
 import logging
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
+from peering.connections import (call_on_routers, exit_abandoning_routers,
+                                 get_connection_pool)
 from peering.models import InternetExchange
 
 
@@ -11,9 +14,60 @@ class Command(BaseCommand):
     help = 'Update peering session states for Internet Exchanges.'
     logger = logging.getLogger('peering.manager.peering')
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Maximum number of routers polled at the same time.')
+        parser.add_argument(
+            '--timeout', type=int,
+            help='Timeout in seconds used to talk to each router (defaults to '
+                 'the NAPALM_TIMEOUT setting).')
+
+    def poll_router(self, router, timeout):
+        try:
+            return router.get_napalm_bgp_neighbors_detail(timeout=timeout)
+        except Exception:
+            self.logger.exception('error while polling %s', router.hostname)
+            return None
+
     def handle(self, *args, **options):
         self.logger.info('Updating peering session states...')
 
-        internet_exchanges = InternetExchange.objects.all()
+        internet_exchanges = [
+            internet_exchange for internet_exchange in
+            InternetExchange.objects.select_related('router')
+            if internet_exchange.can_update_peering_session_states()
+        ]
+
+        # Poll each router only once, even if it is connected to several IXs
+        routers = {}
         for internet_exchange in internet_exchanges:
-            internet_exchange.update_peering_session_states()
+            routers[internet_exchange.router.pk] = internet_exchange.router
+
+        # A router which does not answer must not block the others
+        results, stuck = call_on_routers(
+            lambda router: self.poll_router(router, options['timeout']),
+            routers.values(), workers=options['workers'],
+            timeout=options['timeout'])
+        bgp_neighbors_details = {
+            router.pk: result for router, result in results.items()}
+
+        # Write all states at once, once every router has been polled
+        with transaction.atomic():
+            for internet_exchange in internet_exchanges:
+                bgp_neighbors_detail = bgp_neighbors_details[
+                    internet_exchange.router.pk]
+                if not bgp_neighbors_detail:
+                    self.logger.debug(
+                        'no bgp neighbors detail for %s, ignoring it',
+                        internet_exchange.name.lower())
+                    continue
+
+                internet_exchange.update_peering_session_states(
+                    bgp_neighbors_detail=bgp_neighbors_detail)
+
+        if stuck:
+            exit_abandoning_routers(stuck, self.logger)
+
+        # No need to keep connections opened once the command is done
+        get_connection_pool().close_all()
@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peering', '0017_auto_20180802_2309'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='internetexchange',
+            name='deployed_configuration_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
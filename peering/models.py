@@ -1,18 +1,22 @@
 from __future__ import unicode_literals
 
+import bisect
+import hashlib
 import ipaddress
 import logging
 import napalm
-
-from jinja2 import Template
+import os
+import tempfile
 
 from django.conf import settings
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 
+from .connections import get_connection_pool
 from .constants import (BGP_STATE_CHOICES, BGP_STATE_IDLE, BGP_STATE_CONNECT,
                         BGP_STATE_ACTIVE, BGP_STATE_OPENSENT,
                         BGP_STATE_OPENCONFIRM, BGP_STATE_ESTABLISHED,
@@ -20,8 +24,10 @@ from .constants import (BGP_STATE_CHOICES, BGP_STATE_IDLE, BGP_STATE_CONNECT,
                         COMMUNITY_TYPE_INGRESS, PLATFORM_CHOICES,
                         PLATFORM_JUNOS, PLATFORM_IOSXR, PLATFORM_EOS)
 from .fields import ASNField, CommunityField
+from .templating import get_template_cache
 from peeringdb.api import PeeringDB
 from peeringdb.models import NetworkIXLAN, PeerRecord
+from utils.db import bulk_create, bulk_update
 from utils.models import CreatedUpdatedModel
 
 
@@ -68,6 +74,46 @@ class AutonomousSystem(CreatedUpdatedModel):
 
         return autonomous_system
 
+    @staticmethod
+    def create_from_peeringdb_networks(networks):
+        """
+        Creates the ASes of the given PeeringDB networks which do not exist
+        yet, with as few queries as possible. Returns a dict mapping the ASNs
+        of the networks to their ASes.
+        """
+        networks = {network.asn: network for network in networks}
+        autonomous_systems = AutonomousSystem.objects.in_bulk(
+            list(networks), field_name='asn')
+        missing = [AutonomousSystem(asn=asn, name=network.name,
+                                    irr_as_set=network.irr_as_set,
+                                    ipv6_max_prefixes=network.info_prefixes6,
+                                    ipv4_max_prefixes=network.info_prefixes4)
+                   for asn, network in networks.items()
+                   if asn not in autonomous_systems]
+        if not missing:
+            return autonomous_systems
+
+        try:
+            with transaction.atomic():
+                bulk_create(AutonomousSystem, missing)
+        except IntegrityError:
+            # Some of them have been created at the same time by another
+            # process, create the others one by one
+            for autonomous_system in missing:
+                values = {field.attname: getattr(autonomous_system,
+                                                 field.attname)
+                          for field in AutonomousSystem._meta.concrete_fields
+                          if not field.primary_key}
+                AutonomousSystem.objects.get_or_create(
+                    asn=values.pop('asn'), defaults=values)
+
+        # Primary keys are not set by bulk_create() on every backend
+        autonomous_systems.update(AutonomousSystem.objects.in_bulk(
+            [autonomous_system.asn for autonomous_system in missing],
+            field_name='asn'))
+
+        return autonomous_systems
+
     def get_absolute_url(self):
         return reverse('peering:as_details', kwargs={'asn': self.asn})
 
@@ -86,15 +132,34 @@ class AutonomousSystem(CreatedUpdatedModel):
 
         return internet_exchanges
 
+    @cached_property
+    def common_ix_networks(self):
+        """
+        Common IX networks between us and this AS. They are computed only once
+        for the lifetime of the object (usually a request).
+        """
+        return PeeringDB().get_common_ix_networks_for_asns(settings.MY_ASN,
+                                                           self.asn)
+
     def get_common_internet_exchanges(self):
         """
         Return all IX we have in common with the AS.
         """
-        # Get common IX networks between us and this AS
-        common = PeeringDB().get_common_ix_networks_for_asns(settings.MY_ASN,
-                                                             self.asn)
         return InternetExchange.objects.all().filter(
-            peeringdb_id__in=[us.id for us, _ in common])
+            peeringdb_id__in=[us.id for us, _ in self.common_ix_networks])
+
+    @cached_property
+    def peering_session_ip_addresses(self):
+        """
+        Set of (IX ID, IP address) couples of the existing peering sessions
+        with this AS. They are retrieved only once for the lifetime of the
+        object (usually a request).
+        """
+        return set(
+            (internet_exchange_id, ipaddress.ip_address(ip_address))
+            for internet_exchange_id, ip_address in
+            self.peeringsession_set.values_list('internet_exchange_id',
+                                                'ip_address'))
 
     def get_missing_peering_sessions(self, internet_exchange):
         """
@@ -106,41 +171,24 @@ class AutonomousSystem(CreatedUpdatedModel):
         if not internet_exchange:
             return None
 
-        # Get common IX networks between us and this AS
-        common = PeeringDB().get_common_ix_networks_for_asns(settings.MY_ASN,
-                                                             self.asn)
+        # Existing sessions on the IX
+        existing_ip_addresses = set(
+            ip_address for internet_exchange_id, ip_address in
+            self.peering_session_ip_addresses
+            if internet_exchange_id == internet_exchange.pk)
 
         # Divide sessions based on the IP versions
         ipv6_sessions = []
         ipv4_sessions = []
 
         # For each common networks take a look at it
-        for us, peer in common:
+        for us, peer in self.common_ix_networks:
             # We only care about networks matching the IX we want
             if us.id == internet_exchange.peeringdb_id:
-                # Check on the IPv6 address
-                if peer.ipaddr6:
-                    try:
-                        ip_address = ipaddress.IPv6Address(peer.ipaddr6)
-                        if not PeeringSession.does_exist(
-                                internet_exchange=internet_exchange,
-                                autonomous_system=self,
-                                ip_address=str(ip_address)):
-                            ipv6_sessions.append(ip_address)
-                    except ipaddress.AddressValueError:
-                        continue
-
-                # Check on the IPv4 address
-                if peer.ipaddr4:
-                    try:
-                        ip_address = ipaddress.IPv4Address(peer.ipaddr4)
-                        if not PeeringSession.does_exist(
-                                internet_exchange=internet_exchange,
-                                autonomous_system=self,
-                                ip_address=str(ip_address)):
-                            ipv4_sessions.append(ip_address)
-                    except ipaddress.AddressValueError:
-                        continue
+                missing6, missing4 = PeeringSession.get_missing_ip_addresses(
+                    peer, existing_ip_addresses)
+                ipv6_sessions.extend(missing6)
+                ipv4_sessions.extend(missing4)
 
         return (ipv6_sessions, ipv4_sessions)
 
@@ -314,12 +362,39 @@ class InternetExchange(CreatedUpdatedModel):
     check_bgp_session_states = models.BooleanField(default=False)
     bgp_session_states_update = models.DateTimeField(blank=True, null=True)
     communities = models.ManyToManyField('Community', blank=True)
+    deployed_configuration_hash = models.CharField(max_length=64, blank=True,
+                                                   null=True)
 
     logger = logging.getLogger('peering.manager.peering')
 
+    # Hash of the last generated configuration
+    _configuration_hash = None
+
     class Meta:
         ordering = ['name']
 
+    @staticmethod
+    def get_peeringdb_ix_map():
+        """
+        Returns a dict mapping PeeringDB IX IDs to the Internet exchanges
+        linked to PeeringDB, using two queries.
+        """
+        internet_exchanges = list(InternetExchange.objects.exclude(
+            peeringdb_id__isnull=True))
+        ix_ids = dict(NetworkIXLAN.objects.filter(
+            id__in=[ix.peeringdb_id for ix in internet_exchanges]
+        ).values_list('id', 'ix_id'))
+
+        ix_map = {}
+        for internet_exchange in internet_exchanges:
+            ix_id = ix_ids.get(internet_exchange.peeringdb_id)
+            if ix_id is not None:
+                # Keep the first one if several IXs are on the same PeeringDB
+                # IX, as the IXs were looked up in order before
+                ix_map.setdefault(ix_id, internet_exchange)
+
+        return ix_map
+
     def get_absolute_url(self):
         return reverse('peering:ix_details', kwargs={'slug': self.slug})
 
@@ -346,55 +421,47 @@ class InternetExchange(CreatedUpdatedModel):
         return PeeringDB().get_prefixes_for_ix_network(self.peeringdb_id) or []
 
     def _generate_configuration_variables(self):
-        peers6 = {}
-        peers4 = {}
+        peers = {6: {}, 4: {}}
 
-        # Sort peering sessions based on IP protocol version
-        for session in self.peeringsession_set.all():
-            ip_address = ipaddress.ip_address(session.ip_address)
-            ipv6_max_prefixes = session.autonomous_system.ipv6_max_prefixes
-            ipv4_max_prefixes = session.autonomous_system.ipv4_max_prefixes
-
-            if ip_address.version == 6:
-                if session.autonomous_system.asn not in peers6:
-                    peers6[session.autonomous_system.asn] = {
-                        'as_name': session.autonomous_system.name,
-                        'max_prefixes': ipv6_max_prefixes or 0,
-                        'sessions': [],
-                    }
-
-                peers6[session.autonomous_system.asn]['sessions'].append({
-                    'ip_address': str(ip_address),
-                    'password': session.password or False,
-                    'enabled': session.enabled,
-                })
-
-            if ip_address.version == 4:
-                if session.autonomous_system.asn not in peers4:
-                    peers4[session.autonomous_system.asn] = {
-                        'as_name': session.autonomous_system.name,
-                        'max_prefixes': ipv4_max_prefixes or 0,
-                        'sessions': [],
-                    }
+        # Only fetch the needed columns of the sessions and their ASes with a
+        # single query
+        sessions = self.peeringsession_set.values_list(
+            'ip_address', 'password', 'enabled', 'autonomous_system__asn',
+            'autonomous_system__name',
+            'autonomous_system__ipv6_max_prefixes',
+            'autonomous_system__ipv4_max_prefixes')
 
-                peers4[session.autonomous_system.asn]['sessions'].append({
-                    'ip_address': str(ip_address),
-                    'password': session.password or False,
-                    'enabled': session.enabled,
-                })
+        # Sort peering sessions based on IP protocol version
+        for (ip_address, password, enabled, asn, as_name, ipv6_max_prefixes,
+             ipv4_max_prefixes) in sessions:
+            ip_address = ipaddress.ip_address(ip_address)
+            version_peers = peers[ip_address.version]
+
+            if asn not in version_peers:
+                max_prefixes = ipv6_max_prefixes if ip_address.version == 6 \
+                    else ipv4_max_prefixes
+                version_peers[asn] = {
+                    'as_name': as_name,
+                    'max_prefixes': max_prefixes or 0,
+                    'sessions': [],
+                }
+
+            version_peers[asn]['sessions'].append({
+                'ip_address': str(ip_address),
+                'password': password or False,
+                'enabled': enabled,
+            })
 
         peering_groups = [
-            {'ip_version': 6, 'peers': peers6},
-            {'ip_version': 4, 'peers': peers4},
+            {'ip_version': 6, 'peers': peers[6]},
+            {'ip_version': 4, 'peers': peers[4]},
         ]
 
         # Generate list of communities
-        communities = []
-        for community in self.communities.all():
-            communities.append({
-                'name': community.name,
-                'value': community.value,
-            })
+        communities = [
+            {'name': name, 'value': value}
+            for name, value in self.communities.values_list('name', 'value')
+        ]
 
         values = {
             'internet_exchange': self,
@@ -405,10 +472,81 @@ class InternetExchange(CreatedUpdatedModel):
         return values
 
     def generate_configuration(self):
-        # Load and render the template using Jinja2
-        configuration_template = Template(self.configuration_template.template)
-        return configuration_template.render(
-            self._generate_configuration_variables())
+        values = self._generate_configuration_variables()
+
+        # Load (from the cache if already compiled) and render the template
+        # using Jinja2
+        configuration_template = get_template_cache().get_template(
+            self.configuration_template)
+        configuration = configuration_template.render(values)
+        self._configuration_hash = hashlib.sha256(
+            configuration.encode()).hexdigest()
+
+        return configuration
+
+    def generate_configuration_stream(self, chunk_size=64 * 1024):
+        """
+        Yields the configuration as chunks of about the given size instead of
+        rendering it as a single string. The hash of the configuration is
+        known once all chunks have been consumed.
+        """
+        values = self._generate_configuration_variables()
+        configuration_template = get_template_cache().get_template(
+            self.configuration_template)
+
+        configuration_hash = hashlib.sha256()
+        for chunk in self._group_chunks(
+                configuration_template.generate(values), chunk_size):
+            configuration_hash.update(chunk.encode())
+            yield chunk
+
+        self._configuration_hash = configuration_hash.hexdigest()
+
+    @staticmethod
+    def _group_chunks(parts, chunk_size):
+        # Jinja2 yields very small strings, group them
+        chunk = []
+        size = 0
+        for part in parts:
+            chunk.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+
+        if chunk:
+            yield ''.join(chunk)
+
+    def get_configuration_hash(self):
+        """
+        Returns the hash of the last generated configuration, rendering the
+        configuration (without keeping it) if none was generated yet.
+        """
+        if self._configuration_hash is None:
+            for _ in self.generate_configuration_stream():
+                pass
+
+        return self._configuration_hash
+
+    def is_configuration_deployed(self):
+        """
+        Tells if the last generated configuration is the one which has been
+        deployed on the router the last time.
+        """
+        return self.get_configuration_hash() == \
+            self.deployed_configuration_hash
+
+    def set_configuration_deployed(self, deployed=True):
+        """
+        Records that the last generated configuration has been deployed on
+        the router, or that the router configuration is not known to match
+        any generated configuration if deployed is False.
+        """
+        self.deployed_configuration_hash = self.get_configuration_hash() if \
+            deployed else None
+        InternetExchange.objects.filter(pk=self.pk).update(
+            deployed_configuration_hash=self.deployed_configuration_hash)
 
     def get_available_peers(self):
         # Not linked to PeeringDB, cannot determine peers
@@ -442,6 +580,91 @@ class InternetExchange(CreatedUpdatedModel):
             )
         ).order_by('network__asn')
 
+    def get_missing_peering_sessions(self):
+        """
+        Returns a dict listing, for each known AS connected to the IX
+        according to PeeringDB, a tuple of IP address lists. The first element
+        of the tuple is the IPv6 address list, the second one is the IPv4
+        address list. Each IP address is the address of a missing peering
+        session with the AS. ASes without missing peering sessions are not
+        part of the dict.
+
+        The number of queries does not depend on the number of ASes.
+        """
+        missing_sessions = {}
+
+        # Not linked to PeeringDB, cannot determine peers
+        if not self.peeringdb_id:
+            return missing_sessions
+
+        # Get the IX LAN we are belonging to and all networks on it
+        api = PeeringDB()
+        network_ixlan = api.get_ix_network(self.peeringdb_id)
+        if not network_ixlan:
+            return missing_sessions
+        peer_network_ixlans = [
+            peer for peer in
+            api.get_ix_networks_for_ixlan(network_ixlan.ixlan_id) or []
+            if peer.asn != settings.MY_ASN
+        ]
+
+        autonomous_systems = AutonomousSystem.objects.in_bulk(
+            [peer.asn for peer in peer_network_ixlans], field_name='asn')
+
+        # Existing sessions on the IX
+        existing_ip_addresses = {}
+        for autonomous_system_id, ip_address in \
+                self.peeringsession_set.values_list('autonomous_system_id',
+                                                    'ip_address'):
+            existing_ip_addresses.setdefault(autonomous_system_id, set()).add(
+                ipaddress.ip_address(ip_address))
+
+        for peer in peer_network_ixlans:
+            autonomous_system = autonomous_systems.get(peer.asn)
+            if not autonomous_system:
+                continue
+
+            missing6, missing4 = PeeringSession.get_missing_ip_addresses(
+                peer, existing_ip_addresses.get(autonomous_system.pk, set()))
+            if missing6 or missing4:
+                ipv6_sessions, ipv4_sessions = missing_sessions.setdefault(
+                    autonomous_system, ([], []))
+                ipv6_sessions.extend(missing6)
+                ipv4_sessions.extend(missing4)
+
+        return missing_sessions
+
+    @staticmethod
+    def _index_prefixes(prefixes):
+        """
+        Returns a dict mapping IP versions to a couple of sorted lists: the
+        first addresses and the last addresses of the given prefixes. Prefixes
+        are collapsed first so that none of them overlap, which allows to find
+        the prefix containing an address with a binary search.
+        """
+        index = {}
+
+        for version in (6, 4):
+            networks = list(ipaddress.collapse_addresses(
+                [prefix for prefix in prefixes if prefix.version == version]))
+            index[version] = (
+                [int(network.network_address) for network in networks],
+                [int(network.broadcast_address) for network in networks])
+
+        return index
+
+    @staticmethod
+    def _is_in_prefixes(index, ip_address):
+        """
+        Tells if an IP address fits in one of the prefixes of an index built
+        with _index_prefixes().
+        """
+        first_addresses, last_addresses = index[ip_address.version]
+        value = int(ip_address)
+        position = bisect.bisect_right(first_addresses, value) - 1
+
+        return position >= 0 and value <= last_addresses[position]
+
     def _import_peering_sessions(self, sessions=[], prefixes=[]):
         # No sessions or no prefixes, can't work with that
         if not sessions or not prefixes:
@@ -452,81 +675,71 @@ class InternetExchange(CreatedUpdatedModel):
         number_of_autonomous_systems = 0
         ignored_autonomous_systems = []
 
+        index = self._index_prefixes(prefixes)
+
         with transaction.atomic():
-            # For each session check if the address fits in one of the prefixes
+            existing_ip_addresses = set(
+                ipaddress.ip_address(ip_address) for ip_address in
+                self.peeringsession_set.values_list('ip_address', flat=True))
+
+            # Keep sessions fitting in one of the prefixes and not existing
+            # yet, in the order they were given
+            new_sessions = []
             for session in sessions:
-                for prefix in prefixes:
-                    # No point of checking if a session fits inside a prefix if
-                    # they are not using the same IP version
-                    if session['ip_address'].version is not prefix.version:
-                        self.logger.debug('ip %s cannot fit in prefix %s (not same ip version) ignoring',
-                                          str(session['ip_address']),
-                                          str(prefix))
-                        continue
+                ip_address = session['ip_address']
+                if ip_address in existing_ip_addresses or \
+                        not self._is_in_prefixes(index, ip_address):
+                    continue
+
+                existing_ip_addresses.add(ip_address)
+                new_sessions.append(session)
+
+            self.logger.debug('found %s new sessions out of %s for %s',
+                              len(new_sessions), len(sessions),
+                              self.name.lower())
 
-                    self.logger.debug('checking if ip %s fits in prefix %s',
-                                      str(session['ip_address']), str(prefix))
-
-                    # If the address fits, create a new PeeringSession object
-                    # and a new AutonomousSystem object if they does not exist
-                    # already
-                    if session['ip_address'] in prefix:
-                        ip_address = str(session['ip_address'])
-                        remote_asn = session['remote_asn']
-                        self.logger.debug(
-                            'ip %s fits in prefix %s', ip_address, str(prefix))
-
-                        if not PeeringSession.does_exist(ip_address=ip_address,
-                                                         internet_exchange=self):
-                            self.logger.debug(
-                                'session %s with as%s does not exist',
-                                ip_address, remote_asn)
-
-                            # Grab the AS, create it if it does not exist in
-                            # the database yet
-                            autonomous_system = AutonomousSystem.does_exist(
-                                remote_asn)
-                            if not autonomous_system:
-                                self.logger.debug(
-                                    'as%s not present importing from peeringdb', remote_asn)
-                                autonomous_system = AutonomousSystem.create_from_peeringdb(
-                                    remote_asn)
-
-                                # Do not count the AS if it does not have a
-                                # PeeringDB record
-                                if autonomous_system:
-                                    self.logger.debug(
-                                        'as%s created', remote_asn)
-                                    number_of_autonomous_systems += 1
-                                else:
-                                    if remote_asn not in ignored_autonomous_systems:
-                                        ignored_autonomous_systems.append(
-                                            remote_asn)
-                                    self.logger.debug(
-                                        'could not create as%s, session %s ignored', remote_asn, ip_address)
-
-                            # Only add a peering session if we were able to
-                            # actually use the AS it is linked to
-                            if autonomous_system:
-                                self.logger.debug(
-                                    'creating session %s', ip_address)
-                                values = {
-                                    'autonomous_system': autonomous_system,
-                                    'internet_exchange': self,
-                                    'ip_address': ip_address,
-                                }
-                                peering_session = PeeringSession(**values)
-                                peering_session.save()
-                                number_of_peering_sessions += 1
-                                self.logger.debug(
-                                    'session %s created', ip_address)
-                        else:
-                            self.logger.debug(
-                                'session %s with as%s already exists',
-                                ip_address, remote_asn)
-                    else:
-                        self.logger.debug('ip %s do not fit in prefix %s', str(
-                            session['ip_address']), str(prefix))
+            if not new_sessions:
+                return (number_of_autonomous_systems,
+                        number_of_peering_sessions, ignored_autonomous_systems)
+
+            # Grab the ASes, create the ones that do not exist in the database
+            # yet using their PeeringDB records
+            asns = set(session['remote_asn'] for session in new_sessions)
+            autonomous_systems = AutonomousSystem.objects.in_bulk(
+                list(asns), field_name='asn')
+
+            unknown_asns = asns - set(autonomous_systems)
+            if unknown_asns:
+                self.logger.debug('importing %s ases from peeringdb',
+                                  len(unknown_asns))
+                networks = PeeringDB().get_autonomous_systems(unknown_asns)
+                autonomous_systems.update(
+                    AutonomousSystem.create_from_peeringdb_networks(
+                        networks.values()))
+                number_of_autonomous_systems = len(networks)
+
+            # Only add a peering session if we were able to actually use the
+            # AS it is linked to
+            peering_sessions = []
+            for session in new_sessions:
+                remote_asn = session['remote_asn']
+                if remote_asn not in autonomous_systems:
+                    if remote_asn not in ignored_autonomous_systems:
+                        ignored_autonomous_systems.append(remote_asn)
+                    continue
+
+                peering_sessions.append(PeeringSession(
+                    autonomous_system=autonomous_systems[remote_asn],
+                    internet_exchange=self,
+                    ip_address=str(session['ip_address'])))
+
+            bulk_create(PeeringSession, peering_sessions)
+            number_of_peering_sessions = len(peering_sessions)
+
+            if ignored_autonomous_systems:
+                self.logger.debug(
+                    'could not create %s ases, their sessions are ignored',
+                    len(ignored_autonomous_systems))
 
         return (number_of_autonomous_systems, number_of_peering_sessions,
                 ignored_autonomous_systems)
@@ -565,7 +778,78 @@ class InternetExchange(CreatedUpdatedModel):
 
         return self._import_peering_sessions(bgp_sessions, prefixes)
 
-    def update_peering_session_states(self):
+    def _update_peering_session_states(self, bgp_neighbors_detail):
+        """
+        Updates the BGP states and prefix counts of the sessions of the IX
+        based on BGP neighbors details retrieved with NAPALM. Only sessions
+        with changes are written to the database. Returns the number of
+        updated sessions.
+        """
+        # Existing sessions keyed by their normalized IP addresses
+        peering_sessions = {}
+        for peering_session in self.peeringsession_set.all():
+            ip_address = ipaddress.ip_address(peering_session.ip_address)
+            peering_sessions[ip_address] = peering_session
+
+        now = timezone.now()
+        changed = {}
+        # An empty list is returned if the router could not be reached
+        for vrf, as_details in dict(bgp_neighbors_detail or {}).items():
+            for asn, sessions in as_details.items():
+                # Check BGP sessions found
+                for session in sessions:
+                    try:
+                        ip_address = ipaddress.ip_address(
+                            session['remote_address'])
+                    except ValueError:
+                        continue
+
+                    # Check if the BGP session is on this IX
+                    peering_session = peering_sessions.get(ip_address)
+                    if not peering_session:
+                        continue
+
+                    # Get the BGP state for the session
+                    values = {
+                        'bgp_state': session['connection_state'].lower(),
+                        'received_prefix_count':
+                            session['received_prefix_count'],
+                        'advertised_prefix_count':
+                            session['advertised_prefix_count'],
+                    }
+
+                    # Nothing to write if the session has not changed
+                    if all(getattr(peering_session, name) == value
+                           for name, value in values.items()):
+                        continue
+
+                    for name, value in values.items():
+                        setattr(peering_session, name, value)
+                    peering_session.updated = now
+                    changed[peering_session.pk] = peering_session
+
+        self.logger.debug('found %s sessions out of %s with changes in %s',
+                          len(changed), len(peering_sessions),
+                          self.name.lower())
+
+        with transaction.atomic():
+            bulk_update(PeeringSession, changed.values(),
+                        ['bgp_state', 'received_prefix_count',
+                         'advertised_prefix_count', 'updated'])
+
+            # Save last session states update, without writing back other
+            # fields which may have been changed while polling the router
+            self.bgp_session_states_update = now
+            InternetExchange.objects.filter(pk=self.pk).update(
+                bgp_session_states_update=now)
+
+        return len(changed)
+
+    def can_update_peering_session_states(self):
+        """
+        Tells if the BGP session states of the IX can be retrieved from its
+        router.
+        """
         # Check if we are able to get BGP details
         log = 'ignoring session states on {}, reason: "{}"'
         if not self.router:
@@ -579,48 +863,27 @@ class InternetExchange(CreatedUpdatedModel):
         else:
             log = None
 
-        # If we cannot check for BGP details, don't do anything
         if log:
             self.logger.debug(log)
             return False
 
+        return True
+
+    def update_peering_session_states(self, bgp_neighbors_detail=None):
+        """
+        Updates the BGP states of the sessions of the IX. The BGP neighbors
+        details are retrieved from the router unless they are given (for
+        instance when they were retrieved once for several IXs).
+        """
+        # If we cannot check for BGP details, don't do anything
+        if not self.can_update_peering_session_states():
+            return False
+
         # Get all BGP sessions detail
-        bgp_neighbors_detail = self.router.get_napalm_bgp_neighbors_detail()
-        with transaction.atomic():
-            for vrf, as_details in bgp_neighbors_detail.items():
-                for asn, sessions in as_details.items():
-                    # Check BGP sessions found
-                    for session in sessions:
-                        ip_address = session['remote_address']
-                        self.logger.debug(
-                            'looking for session %s in %s', ip_address,
-                            self.name.lower())
-
-                        # Check if the BGP session is on this IX
-                        peering_session = PeeringSession.does_exist(
-                            internet_exchange=self, ip_address=ip_address)
-                        if peering_session:
-                            # Get the BGP state for the session
-                            state = session['connection_state'].lower()
-                            received = session['received_prefix_count']
-                            advertised = session['advertised_prefix_count']
-                            self.logger.debug(
-                                'found session %s in %s with state %s',
-                                ip_address, self.name.lower(), state)
-
-                            # Update the BGP state of the session
-                            peering_session.bgp_state = state
-                            peering_session.received_prefix_count = received
-                            peering_session.advertised_prefix_count = advertised
-                            peering_session.save()
-                        else:
-                            self.logger.debug(
-                                'session %s in %s not found', ip_address,
-                                self.name.lower())
-
-            # Save last session states update
-            self.bgp_session_states_update = timezone.now()
-            self.save()
+        if bgp_neighbors_detail is None:
+            bgp_neighbors_detail = \
+                self.router.get_napalm_bgp_neighbors_detail()
+        self._update_peering_session_states(bgp_neighbors_detail)
 
         return True
 
@@ -659,71 +922,121 @@ class PeeringSession(BGPSession):
             return None
 
     @staticmethod
-    def get_from_peeringdb_peer_record(peer_record, ip_version):
-        internet_exchange = None
-        peer_ixlan = None
-
-        # If no peer record, no ASN or no IP address have been given, we
-        # cannot do anything
-        if (not peer_record or not peer_record.network.asn):
-            return (None, False)
-
-        # Find the Internet exchange given a NetworkIXLAN ID
-        for ix in InternetExchange.objects.exclude(peeringdb_id__isnull=True):
-            # Get the IXLAN corresponding to our network
-            ixlan = NetworkIXLAN.objects.get(id=ix.peeringdb_id)
-            # Get a potentially matching IXLAN
-            peer_ixlan = NetworkIXLAN.objects.filter(
-                id=peer_record.network_ixlan.id, ix_id=ixlan.ix_id)
-
-            # IXLAN found lets get out
-            if peer_ixlan:
-                internet_exchange = ix
-                break
-
-        # Unable to find the Internet exchange, no point of going further
-        if not internet_exchange:
-            return (None, False)
-
-        # Get the AS, create it if necessary
-        autonomous_system = AutonomousSystem.create_from_peeringdb(
-            peer_record.network.asn)
+    def get_missing_ip_addresses(network_ixlan, existing_ip_addresses):
+        """
+        Returns a tuple with the IPv6 address and the IPv4 address (as lists)
+        of a PeeringDB IX network that are not part of the given set of
+        existing IP addresses. Invalid IP addresses are ignored.
+        """
+        ipv6_addresses = []
+        ipv4_addresses = []
 
-        if ip_version == 6:
+        # Check on the IPv6 address
+        if network_ixlan.ipaddr6:
             try:
-                ipaddress.IPv6Address(peer_record.network_ixlan.ipaddr6)
+                ip_address = ipaddress.IPv6Address(network_ixlan.ipaddr6)
+                if ip_address not in existing_ip_addresses:
+                    ipv6_addresses.append(ip_address)
             except ipaddress.AddressValueError:
-                # IPv6 parsing failed, ignore the session
-                return (None, False)
-        elif ip_version == 4:
+                pass
+
+        # Check on the IPv4 address
+        if network_ixlan.ipaddr4:
             try:
-                ipaddress.IPv4Address(peer_record.network_ixlan.ipaddr4)
+                ip_address = ipaddress.IPv4Address(network_ixlan.ipaddr4)
+                if ip_address not in existing_ip_addresses:
+                    ipv4_addresses.append(ip_address)
             except ipaddress.AddressValueError:
-                # IPv4 parsing failed, ignore the session
-                return (None, False)
-        else:
-            # Not a valid IP protocol version
-            return (None, False)
+                pass
 
-        # Assume we are always using IPv6 unless told otherwise
-        ip_address = (peer_record.network_ixlan.ipaddr4 if ip_version == 4 else
-                      peer_record.network_ixlan.ipaddr6)
+        return (ipv6_addresses, ipv4_addresses)
 
-        # Try to get the session, in case it already exists
-        session = PeeringSession.does_exist(
-            autonomous_system=autonomous_system,
-            internet_exchange=internet_exchange, ip_address=ip_address)
+    @staticmethod
+    def get_from_peeringdb_peer_record(peer_record, ip_version):
+        # If no peer record, no ASN or no IP address have been given, we
+        # cannot do anything
+        if (not peer_record or not peer_record.network.asn):
+            return (None, False)
 
-        # Session exists, nothing to do
-        if session:
-            return (session, False)
+        for session, created in PeeringSession.get_from_peeringdb_peer_records(
+                [peer_record], ip_versions=[ip_version]):
+            return (session, created)
 
-        # Create the session but do not save it
-        session = PeeringSession(autonomous_system=autonomous_system,
-                                 internet_exchange=internet_exchange,
-                                 ip_address=ip_address)
+        return (None, False)
 
-        return (session, True)
+    @staticmethod
+    def get_from_peeringdb_peer_records(peer_records, ip_versions=(6, 4)):
+        """
+        Returns a list of (session, created) tuples, one for each IP version
+        and each peer record for which a peering session can be set up. The
+        session is an existing one (created is False) or a new session that is
+        not saved yet (created is True). Missing ASes are created.
+
+        The number of queries does not depend on the number of peer records.
+        """
+        peer_records = [peer_record for peer_record in peer_records
+                        if peer_record and peer_record.network.asn]
+        ix_map = InternetExchange.get_peeringdb_ix_map()
+
+        # Find the Internet exchange and the IP addresses of each peer record
+        candidates = []
+        for peer_record in peer_records:
+            internet_exchange = ix_map.get(peer_record.network_ixlan.ix_id)
+            # Unable to find the Internet exchange, no point of going further
+            if not internet_exchange:
+                continue
+
+            for ip_version in ip_versions:
+                ip_address = (peer_record.network_ixlan.ipaddr4
+                              if ip_version == 4 else
+                              peer_record.network_ixlan.ipaddr6)
+                try:
+                    ip_address = ipaddress.ip_address(ip_address)
+                except ValueError:
+                    # IP parsing failed, ignore the session
+                    continue
+                if ip_address.version != ip_version:
+                    continue
+
+                candidates.append((peer_record.network, internet_exchange,
+                                   str(ip_address)))
+
+        if not candidates:
+            return []
+
+        # Get the ASes, create the missing ones using the PeeringDB records
+        autonomous_systems = AutonomousSystem.create_from_peeringdb_networks(
+            [network for network, _, _ in candidates])
+
+        # Get the sessions that already exist
+        existing_sessions = {}
+        for session in PeeringSession.objects.filter(
+                internet_exchange__in=set(
+                    [ix for _, ix, _ in candidates]),
+                ip_address__in=set([ip for _, _, ip in candidates])):
+            key = (session.autonomous_system_id, session.internet_exchange_id,
+                   str(ipaddress.ip_address(session.ip_address)))
+            existing_sessions[key] = session
+
+        sessions = []
+        for network, internet_exchange, ip_address in candidates:
+            autonomous_system = autonomous_systems[network.asn]
+            session = existing_sessions.get((autonomous_system.pk,
+                                             internet_exchange.pk,
+                                             ip_address))
+
+            # Session exists, nothing to do
+            if session:
+                sessions.append((session, False))
+                continue
+
+            # Create the session but do not save it
+            sessions.append((PeeringSession(
+                autonomous_system=autonomous_system,
+                internet_exchange=internet_exchange,
+                ip_address=ip_address), True))
+
+        return sessions
 
     def get_absolute_url(self):
         return reverse('peering:peering_session_details',
@@ -755,7 +1068,7 @@ class Router(CreatedUpdatedModel):
             PLATFORM_EOS, PLATFORM_IOSXR, PLATFORM_JUNOS
         ]
 
-    def get_napalm_device(self):
+    def get_napalm_device(self, timeout=None):
         self.logger.debug('looking for napalm driver "%s"', self.platform)
         try:
             # Driver found, instanciate it
@@ -764,7 +1077,7 @@ class Router(CreatedUpdatedModel):
             return driver(hostname=self.hostname,
                           username=settings.NAPALM_USERNAME,
                           password=settings.NAPALM_PASSWORD,
-                          timeout=settings.NAPALM_TIMEOUT,
+                          timeout=timeout or settings.NAPALM_TIMEOUT,
                           optional_args=settings.NAPALM_ARGS)
         except napalm.base.exceptions.ModuleImportError:
             # Unable to import proper driver from napalm
@@ -823,49 +1136,70 @@ class Router(CreatedUpdatedModel):
 
     def test_napalm_connection(self):
         """
-        Opens and closes a connection with a device using NAPALM to see if it
-        is possible to interact with it.
+        Gets a connection with a device using NAPALM to see if it is possible
+        to interact with it. The connection can be one which is already opened
+        and kept in the connection pool.
 
-        This method returns True only if the connection opening and closing are
-        both successful.
+        This method returns True only if the connection is opened and alive.
         """
-        device = self.get_napalm_device()
-
-        # Open and close the test_napalm_connection
         self.logger.debug('testing connection with %s', self.hostname)
-        opened = self.open_napalm_device(device)
-        alive = device.is_alive()
-        closed = self.close_napalm_device(device)
+        with get_connection_pool().connection(self) as device:
+            alive = bool(device) and device.is_alive().get('is_alive', False)
 
-        # Issue while opening or closing the connection
-        if not opened or not closed or not alive:
+        # Issue while opening the connection
+        if not alive:
             self.logger.error(
                 'cannot connect to % s, napalm functions won\'t work',
                 self.hostname)
 
-        return (opened and closed)
+        return alive
 
-    def set_napalm_configuration(self, config, commit=False):
+    def set_napalm_configuration(self, config, commit=False, timeout=None):
         """
         Tries to merge a given configuration on a device using NAPALM.
 
+        The configuration can be a string or an iterable of strings (chunks
+        of the configuration). Chunks are written to a temporary file given to
+        NAPALM, so the whole configuration is never held in memory.
+
         This methods returns the changes applied to the configuration if the
         merge was successful. It will return None in any other cases.
 
         The optional named argument 'commit' is a boolean which is used to
         know if the changes must be commited or discarded. The default value is
         False which means that the changes will be discarded.
+
+        The timeout used to talk to the router defaults to the NAPALM_TIMEOUT
+        setting.
         """
+        if isinstance(config, str):
+            return self._set_napalm_configuration({'config': config}, commit,
+                                                  timeout)
+
+        descriptor, filename = tempfile.mkstemp(suffix='.conf')
+        try:
+            with os.fdopen(descriptor, 'w') as config_file:
+                for chunk in config:
+                    config_file.write(chunk)
+
+            return self._set_napalm_configuration({'filename': filename},
+                                                  commit, timeout)
+        finally:
+            os.remove(filename)
+
+    def _set_napalm_configuration(self, candidate, commit, timeout):
         changes = None
 
-        device = self.get_napalm_device()
-        opened = self.open_napalm_device(device)
+        try:
+            # Connections failing to merge are not given back to the pool
+            with get_connection_pool().connection(
+                    self, timeout=timeout) as device:
+                if not device:
+                    return changes
 
-        if opened:
-            try:
                 # Load the config
                 self.logger.debug('merging configuration on %s', self.hostname)
-                device.load_merge_candidate(config=config)
+                device.load_merge_candidate(**candidate)
 
                 # Get the config diff
                 self.logger.debug(
@@ -883,25 +1217,19 @@ class Router(CreatedUpdatedModel):
                     self.logger.debug(
                         'discarding configuration on %s', self.hostname)
                     device.discard_config()
-            except napalm.base.exceptions.MergeConfigException as e:
-                changes = None
-                self.logger.debug(
-                    'unable to merge configuration on %s reason "%s"',
-                    self.hostname, e)
-            except Exception as e:
-                changes = None
-                self.logger.debug(
-                    'unable to merge configuration on %s error "%s"',
-                    self.hostname, e)
-            else:
-                self.logger.debug(
-                    'successfully merged configuration on %s', self.hostname)
-            finally:
-                closed = self.close_napalm_device(device)
-                if not closed:
-                    self.logger.debug(
-                        'error while closing connection with %s',
-                        self.hostname)
+        except napalm.base.exceptions.MergeConfigException as e:
+            changes = None
+            self.logger.debug(
+                'unable to merge configuration on %s reason "%s"',
+                self.hostname, e)
+        except Exception as e:
+            changes = None
+            self.logger.debug(
+                'unable to merge configuration on %s error "%s"',
+                self.hostname, e)
+        else:
+            self.logger.debug(
+                'successfully merged configuration on %s', self.hostname)
 
         return changes
 
@@ -957,57 +1285,43 @@ class Router(CreatedUpdatedModel):
         """
         bgp_sessions = []
 
-        device = self.get_napalm_device()
-        opened = self.open_napalm_device(device)
-
-        if opened:
-            # Get all BGP neighbors on the router
-            self.logger.debug('getting bgp neighbors on %s', self.hostname)
-            bgp_neighbors = device.get_bgp_neighbors()
-            self.logger.debug('raw napalm output %s', bgp_neighbors)
-            self.logger.debug('found %s vrfs with bgp neighbors on %s', len(
-                bgp_neighbors), self.hostname)
-
-            bgp_sessions = self._napalm_bgp_neighbors_to_peer_list(
-                bgp_neighbors)
-            self.logger.debug('found %s bgp neighbors on %s',
-                              len(bgp_sessions), self.hostname)
-
-            # Close connection to the device
-            closed = self.close_napalm_device(device)
-            if not closed:
-                self.logger.debug(
-                    'error while closing connection with %s', self.hostname)
+        with get_connection_pool().connection(self) as device:
+            if device:
+                # Get all BGP neighbors on the router
+                self.logger.debug('getting bgp neighbors on %s', self.hostname)
+                bgp_neighbors = device.get_bgp_neighbors()
+                self.logger.debug('raw napalm output %s', bgp_neighbors)
+                self.logger.debug('found %s vrfs with bgp neighbors on %s',
+                                  len(bgp_neighbors), self.hostname)
+
+                bgp_sessions = self._napalm_bgp_neighbors_to_peer_list(
+                    bgp_neighbors)
+                self.logger.debug('found %s bgp neighbors on %s',
+                                  len(bgp_sessions), self.hostname)
 
         return bgp_sessions
 
-    def get_napalm_bgp_neighbors_detail(self):
+    def get_napalm_bgp_neighbors_detail(self, timeout=None):
         """
         Returns a list of dictionaries listing all BGP neighbors found on the
-        router using NAPALM and there respective detail.
+        router using NAPALM and there respective detail. The timeout used to
+        talk to the router (if a new connection has to be opened) defaults to
+        the NAPALM_TIMEOUT setting.
 
         If an error occurs or no BGP neighbors can be found, the returned list
         will be empty.
         """
         bgp_neighbors_detail = []
 
-        device = self.get_napalm_device()
-        opened = self.open_napalm_device(device)
-
-        if opened:
-            # Get all BGP neighbors on the router
-            self.logger.debug(
-                'getting bgp neighbors detail on %s', self.hostname)
-            bgp_neighbors_detail = device.get_bgp_neighbors_detail()
-            self.logger.debug('raw napalm output %s', bgp_neighbors_detail)
-            self.logger.debug('found %s vrfs with bgp neighbors on %s', len(
-                bgp_neighbors_detail), self.hostname)
-
-            # Close connection to the device
-            closed = self.close_napalm_device(device)
-            if not closed:
+        with get_connection_pool().connection(self, timeout=timeout) as device:
+            if device:
+                # Get all BGP neighbors on the router
                 self.logger.debug(
-                    'error while closing connection with %s', self.hostname)
+                    'getting bgp neighbors detail on %s', self.hostname)
+                bgp_neighbors_detail = device.get_bgp_neighbors_detail()
+                self.logger.debug('raw napalm output %s', bgp_neighbors_detail)
+                self.logger.debug('found %s vrfs with bgp neighbors on %s',
+                                  len(bgp_neighbors_detail), self.hostname)
 
         return bgp_neighbors_detail
 
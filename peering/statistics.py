@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+
+from .models import (AutonomousSystem, Community, ConfigurationTemplate,
+                     InternetExchange, PeeringSession, Router)
+from peeringdb.models import Synchronization
+from utils.audit import user_actions_flushed
+from utils.db import count_objects, post_bulk_create
+from utils.models import UserAction
+
+
+# Counters displayed on the home page and the model they count
+COUNTED_MODELS = [
+    ('as_count', AutonomousSystem),
+    ('ix_count', InternetExchange),
+    ('communities_count', Community),
+    ('config_templates_count', ConfigurationTemplate),
+    ('routers_count', Router),
+    ('peering_sessions_count', PeeringSession),
+]
+
+STATISTICS_CACHE_KEY = 'peering_statistics'
+HISTORY_CACHE_KEY = 'peering_statistics_history'
+SYNCHRONIZATIONS_CACHE_KEY = 'peering_statistics_synchronizations'
+
+
+def is_cache_shared():
+    """
+    Tells if the default cache is shared by all processes. Values cannot be
+    cached in a cache local to each process, other processes would not know
+    when they have to be invalidated.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS],
+                          (LocMemCache, DummyCache))
+
+
+def _get_cached(key, compute):
+    if not is_cache_shared():
+        return compute()
+
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, settings.STATISTICS_CACHE_TIMEOUT)
+
+    return value
+
+
+def _count_objects():
+    counts = count_objects([model for _, model in COUNTED_MODELS])
+    return dict(zip([name for name, _ in COUNTED_MODELS], counts))
+
+
+def get_statistics():
+    """
+    Returns a dict giving the number of objects of each model displayed on the
+    home page. Numbers are computed with a single query and, if the cache is
+    shared, cached until an object is created or deleted.
+    """
+    return _get_cached(STATISTICS_CACHE_KEY, _count_objects)
+
+
+def get_history(number=50):
+    """
+    Returns the most recent user actions, cached until an action is logged if
+    the cache is shared.
+    """
+    return _get_cached(
+        HISTORY_CACHE_KEY,
+        lambda: list(UserAction.objects.select_related('user')[:number]))
+
+
+def get_synchronizations(number=5):
+    """
+    Returns the most recent PeeringDB synchronizations, cached until a new one
+    is recorded if the cache is shared.
+    """
+    return _get_cached(
+        SYNCHRONIZATIONS_CACHE_KEY,
+        lambda: list(Synchronization.objects.all()[:number]))
+
+
+def check_cache(app_configs, **kwargs):
+    """
+    Warns that the home page values are not cached, when checking the
+    deployment with "manage.py check --deploy".
+    """
+    if is_cache_shared():
+        return []
+
+    return [checks.Warning(
+        'The home page statistics are not cached.',
+        hint='Set CACHES to use a cache shared by all processes, such as '
+             'memcached, to cache them.',
+        id='peering.W001')]
+
+
+def invalidate_statistics(**kwargs):
+    """
+    Forgets the cached numbers of objects. Must be called after creating or
+    deleting objects without sending signals (QuerySet.bulk_create() for
+    instance, utils.db.bulk_create() sends a signal).
+    """
+    cache.delete(STATISTICS_CACHE_KEY)
+
+
+def invalidate_history(**kwargs):
+    cache.delete(HISTORY_CACHE_KEY)
+
+
+def invalidate_synchronizations(**kwargs):
+    cache.delete(SYNCHRONIZATIONS_CACHE_KEY)
+
+
+def connect_signals():
+    """
+    Invalidates the cached values when the objects they depend on change.
+    """
+    for _, model in COUNTED_MODELS:
+        post_save.connect(_invalidate_statistics_on_create, sender=model,
+                          dispatch_uid='statistics_{}'.format(
+                              model._meta.label_lower))
+        post_delete.connect(invalidate_statistics, sender=model,
+                            dispatch_uid='statistics_{}'.format(
+                                model._meta.label_lower))
+        post_bulk_create.connect(invalidate_statistics, sender=model,
+                                 dispatch_uid='statistics_{}'.format(
+                                     model._meta.label_lower))
+
+    # Actions written by batches do not send post_save signals
+    user_actions_flushed.connect(invalidate_history,
+                                 dispatch_uid='statistics_user_actions')
+
+    for model, invalidate in [(UserAction, invalidate_history),
+                              (Synchronization, invalidate_synchronizations)]:
+        post_save.connect(invalidate, sender=model,
+                          dispatch_uid='statistics_{}'.format(
+                              model._meta.label_lower))
+        post_delete.connect(invalidate, sender=model,
+                            dispatch_uid='statistics_{}'.format(
+                                model._meta.label_lower))
+
+
+def _invalidate_statistics_on_create(created=False, **kwargs):
+    # Updating an object does not change the number of objects
+    if created:
+        invalidate_statistics()
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from jinja2 import Environment, FileSystemBytecodeCache
+
+from django.conf import settings
+
+
+class TemplateCache(object):
+    """
+    Process-wide cache of compiled Jinja2 templates used to render
+    configuration templates. Templates are identified by their primary keys
+    and last update times so that an edited template is compiled again. The
+    least recently used templates are evicted once the cache is full.
+
+    If a directory is given, the compiled code is also stored on disk so that
+    a restarted process does not have to compile the templates again.
+    """
+
+    def __init__(self, size=128, directory=None):
+        self.size = size
+        self.bytecode_cache = None
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.bytecode_cache = FileSystemBytecodeCache(directory)
+        # Templates built with jinja2.Template() use the default environment
+        self.environment = Environment()
+        self.lock = threading.Lock()
+        self.templates = OrderedDict()
+
+    def _compile(self, name, source):
+        if not self.bytecode_cache:
+            return self.environment.from_string(source)
+
+        # Same as what Jinja2 loaders do when a bytecode cache is used
+        bucket = self.bytecode_cache.get_bucket(self.environment, name, None,
+                                                source)
+        if bucket.code is None:
+            bucket.code = self.environment.compile(source, name)
+            self.bytecode_cache.set_bucket(bucket)
+
+        return self.environment.template_class.from_code(
+            self.environment, bucket.code, self.environment.make_globals(None))
+
+    def get_template(self, configuration_template):
+        """
+        Returns the compiled Jinja2 template of a configuration template.
+        """
+        key = (configuration_template.pk, configuration_template.updated)
+        source = configuration_template.template
+
+        with self.lock:
+            cached = self.templates.get(key)
+            # Also compare the source in case the template was changed without
+            # updating its last update time
+            if cached and cached[0] == source:
+                self.templates.move_to_end(key)
+                return cached[1]
+
+        template = self._compile(
+            'configuration_template_{}'.format(configuration_template.pk),
+            source)
+
+        with self.lock:
+            self.templates[key] = (source, template)
+            self.templates.move_to_end(key)
+            while len(self.templates) > self.size:
+                self.templates.popitem(last=False)
+
+        return template
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+
+_template_cache = None
+_template_cache_lock = threading.Lock()
+
+
+def get_template_cache():
+    """
+    Returns the template cache shared by the whole process, creating it on
+    first use based on the settings.
+    """
+    global _template_cache
+
+    with _template_cache_lock:
+        if not _template_cache:
+            _template_cache = TemplateCache(
+                size=settings.CONFIGURATION_TEMPLATE_CACHE_SIZE,
+                directory=settings.CONFIGURATION_TEMPLATE_CACHE_DIRECTORY)
+
+    return _template_cache
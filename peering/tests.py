@@ -1,15 +1,43 @@
 from __future__ import unicode_literals
 
+import hashlib
 import ipaddress
-
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+
+from io import StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.forms import formset_factory
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 
+from .connections import NapalmConnectionPool
+from .forms import (InternetExchangeCSVForm,
+                    InternetExchangePeeringDBFormSet)
 from .constants import (COMMUNITY_TYPE_INGRESS, COMMUNITY_TYPE_EGRESS,
                         PLATFORM_JUNOS)
-from .models import (AutonomousSystem, Community, InternetExchange,
-                     PeeringSession, Router)
-
+from .models import (AutonomousSystem, Community, ConfigurationTemplate,
+                     InternetExchange, PeeringSession, Router)
+from .statistics import (check_cache, get_history, get_statistics,
+                         invalidate_statistics, is_cache_shared)
+from .templating import TemplateCache
+from .views import IXConfig
+
+from peeringdb.models import Network, NetworkIXLAN, PeerRecord
+from utils.forms import CSVRecordValidator, has_custom_validation
+from utils.models import UserAction
 from utils.tests import ViewTestCase
 
 
@@ -52,6 +80,31 @@ class AutonomousSystemTestCase(TestCase):
         # Must exist now also
         self.assertEqual(asn, AutonomousSystem.does_exist(asn).asn)
 
+    def test_create_from_peeringdb_networks(self):
+        existing = AutonomousSystem.objects.create(asn=64500, name='Existing')
+        networks = [Network(asn=asn, name='Network {}'.format(asn),
+                            info_prefixes6=asn - 64500)
+                    for asn in [64500, 64501, 64502]]
+
+        # Known ASes, missing ones created in a savepoint and read again
+        with self.assertNumQueries(5):
+            autonomous_systems = \
+                AutonomousSystem.create_from_peeringdb_networks(networks)
+        self.assertEqual([64500, 64501, 64502], sorted(autonomous_systems))
+        self.assertEqual(existing, autonomous_systems[64500])
+        self.assertEqual('Existing', autonomous_systems[64500].name)
+        self.assertEqual(2, autonomous_systems[64502].ipv6_max_prefixes)
+
+        # ASes created at the same time by another process
+        networks.append(Network(asn=64503, name='Network 64503'))
+        networks.append(Network(asn=64504, name='Network 64504'))
+        with patch('peering.models.bulk_create', side_effect=IntegrityError):
+            autonomous_systems = \
+                AutonomousSystem.create_from_peeringdb_networks(networks)
+        self.assertEqual('Network 64503', autonomous_systems[64503].name)
+        self.assertEqual('Network 64504', autonomous_systems[64504].name)
+        self.assertEqual(5, AutonomousSystem.objects.count())
+
     def test_sync_with_peeringdb(self):
         # Create legal AS to sync with PeeringDB
         asn = 29467
@@ -66,6 +119,38 @@ class AutonomousSystemTestCase(TestCase):
         self.assertEqual(asn, autonomous_system.asn)
         self.assertFalse(autonomous_system.sync_with_peeringdb())
 
+    def test_get_missing_peering_sessions(self):
+        autonomous_system = AutonomousSystem.objects.create(asn=64500,
+                                                            name='Test')
+        internet_exchange = InternetExchange.objects.create(
+            name='Test', slug='test', peeringdb_id=1)
+        NetworkIXLAN.objects.create(id=1, asn=settings.MY_ASN, name='Test',
+                                    ipaddr4='192.168.0.1', ix_id=1,
+                                    ixlan_id=1)
+        NetworkIXLAN.objects.create(id=2, asn=64500, name='Test',
+                                    ipaddr6='2001:db8::2',
+                                    ipaddr4='192.168.0.2', ix_id=1,
+                                    ixlan_id=1)
+        PeeringSession.objects.create(autonomous_system=autonomous_system,
+                                      internet_exchange=internet_exchange,
+                                      ip_address='192.168.0.2')
+
+        # Common networks and existing sessions are retrieved only once
+        with self.assertNumQueries(4):
+            self.assertEqual(
+                [internet_exchange],
+                list(autonomous_system.get_common_internet_exchanges()))
+            self.assertEqual(
+                ([ipaddress.ip_address('2001:db8::2')], []),
+                autonomous_system.get_missing_peering_sessions(
+                    internet_exchange))
+            autonomous_system.get_missing_peering_sessions(internet_exchange)
+
+        # Same result for all ASes of the IX at once
+        self.assertEqual(
+            {autonomous_system: ([ipaddress.ip_address('2001:db8::2')], [])},
+            internet_exchange.get_missing_peering_sessions())
+
     def test__str__(self):
         asn = 64500
         name = 'Test'
@@ -135,6 +220,43 @@ class AutonomousSystemViewsTestCase(ViewTestCase):
         self.post_request('peering:as_import', data=as_not_to_import)
         self.does_object_not_exist({'asn': 64501})
 
+    def test_as_import_file_view(self):
+        self.authenticate_user()
+
+        # Import many objects from a file
+        rows = ['asn,name,irr_as_set,ipv6_max_prefixes,ipv4_max_prefixes']
+        rows.extend(['{},as-{},,,10'.format(64500 + i, i) for i in range(20)])
+        response = self.client.post(reverse('peering:as_import'), {
+            'csv_file': SimpleUploadedFile(
+                'as.csv', '\n'.join(rows).encode('utf-8'))
+        })
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(20, AutonomousSystem.objects.filter(
+            name__startswith='as-').count())
+        self.assertEqual(
+            10, AutonomousSystem.objects.get(asn=64519).ipv4_max_prefixes)
+
+        # Invalid rows are reported and nothing is imported
+        rows = ['asn,name', '64520,as-20', '64521,', '64500,as-0',
+                '64520,as-20-again']
+        response = self.client.post(reverse('peering:as_import'), {
+            'csv_file': SimpleUploadedFile(
+                'as.csv', '\n'.join(rows).encode('utf-8'))
+        })
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, 'Row 2 name: This field is required.')
+        self.assertContains(
+            response, 'Row 3 asn: Autonomous system with this Asn already '
+                      'exists.')
+        self.assertContains(response, 'Row 4 asn:')
+        self.does_object_not_exist({'asn': 64520})
+
+        # Unknown column
+        response = self.client.post(reverse('peering:as_import'), {
+            'csv_file': SimpleUploadedFile('as.csv', b'asn,unknown\n1,2')
+        })
+        self.assertContains(response, 'Unexpected column header')
+
     def test_as_import_from_peeringdb_view(self):
         # Not logged in, no right to access the view, should be redirected
         self.get_request('peering:as_import_from_peeringdb',
@@ -476,6 +598,207 @@ class InternetExchangeTestCase(TestCase):
                                                           prefix_lists[i]))
             self.assertEqual(expected[i][1], len(ixp.get_peering_sessions()))
 
+    def test_import_peering_sessions_with_cache(self):
+        # Known AS and AS only found in the PeeringDB cache
+        AutonomousSystem.objects.create(asn=64500, name='Test 1')
+        Network.objects.create(id=1, asn=64501, name='Test 2')
+
+        ixp = InternetExchange.objects.create(name='Test', slug='test')
+        PeeringSession.objects.create(
+            autonomous_system=AutonomousSystem.objects.get(asn=64500),
+            internet_exchange=ixp, ip_address='192.168.0.1')
+
+        sessions = [
+            # Already existing
+            {'ip_address': ipaddress.ip_address('192.168.0.1'),
+             'remote_asn': 64500},
+            # New sessions, one being given twice
+            {'ip_address': ipaddress.ip_address('192.168.1.2'),
+             'remote_asn': 64500},
+            {'ip_address': ipaddress.ip_address('2001:db8::2'),
+             'remote_asn': 64501},
+            {'ip_address': ipaddress.ip_address('2001:db8::2'),
+             'remote_asn': 64501},
+            # Not fitting in any prefixes
+            {'ip_address': ipaddress.ip_address('192.168.2.1'),
+             'remote_asn': 64501},
+            {'ip_address': ipaddress.ip_address('2001:db8:1::1'),
+             'remote_asn': 64501},
+        ]
+        prefixes = [ipaddress.ip_network('192.168.0.0/24'),
+                    ipaddress.ip_network('192.168.0.0/23'),
+                    ipaddress.ip_network('2001:db8::/64')]
+
+        self.assertEqual((1, 2, []),
+                         ixp._import_peering_sessions(sessions, prefixes))
+        self.assertEqual(
+            ['192.168.0.1', '192.168.1.2', '2001:db8::2'],
+            sorted(ixp.get_peering_sessions().values_list('ip_address',
+                                                          flat=True)))
+        self.assertEqual(
+            'Test 2', AutonomousSystem.objects.get(asn=64501).name)
+
+    def test_update_peering_session_states(self):
+        autonomous_system = AutonomousSystem.objects.create(asn=64500,
+                                                            name='Test')
+        ixp = InternetExchange.objects.create(name='Test', slug='test')
+        for ip_address in ['2001:db8::1', '192.168.0.1', '192.168.0.2']:
+            PeeringSession.objects.create(autonomous_system=autonomous_system,
+                                          internet_exchange=ixp,
+                                          ip_address=ip_address,
+                                          bgp_state='idle')
+
+        bgp_neighbors_detail = {
+            'global': {
+                64500: [
+                    {'remote_address': '2001:DB8::1',
+                     'connection_state': 'Established',
+                     'received_prefix_count': 10,
+                     'advertised_prefix_count': 20},
+                    # Unchanged session
+                    {'remote_address': '192.168.0.2',
+                     'connection_state': 'Idle',
+                     'received_prefix_count': None,
+                     'advertised_prefix_count': None},
+                    # Not on this IX
+                    {'remote_address': '192.168.1.1',
+                     'connection_state': 'Established',
+                     'received_prefix_count': 10,
+                     'advertised_prefix_count': 20},
+                ],
+            },
+        }
+
+        self.assertEqual(
+            1, ixp._update_peering_session_states(bgp_neighbors_detail))
+        peering_session = PeeringSession.objects.get(ip_address='2001:db8::1')
+        self.assertEqual('established', peering_session.bgp_state)
+        self.assertEqual(10, peering_session.received_prefix_count)
+        self.assertEqual(20, peering_session.advertised_prefix_count)
+        self.assertEqual(['idle', 'idle'], list(
+            PeeringSession.objects.exclude(pk=peering_session.pk).values_list(
+                'bgp_state', flat=True)))
+        self.assertIsNotNone(ixp.bgp_session_states_update)
+        self.assertEqual(
+            ixp.bgp_session_states_update,
+            InternetExchange.objects.get(pk=ixp.pk).bgp_session_states_update)
+
+        # Fields changed while polling must not be overwritten
+        InternetExchange.objects.filter(pk=ixp.pk).update(name='Changed')
+        ixp._update_peering_session_states(bgp_neighbors_detail)
+        self.assertEqual('Changed',
+                         InternetExchange.objects.get(pk=ixp.pk).name)
+
+        # Nothing changed the second time
+        self.assertEqual(
+            0, ixp._update_peering_session_states(bgp_neighbors_detail))
+
+    def test_update_peering_session_states_command(self):
+        autonomous_system = AutonomousSystem.objects.create(asn=64500,
+                                                            name='Test')
+        router = Router.objects.create(name='Test', hostname='test.example',
+                                       platform=PLATFORM_JUNOS)
+        for i in range(2):
+            ixp = InternetExchange.objects.create(
+                name='Test {}'.format(i), slug='test_{}'.format(i),
+                router=router, check_bgp_session_states=True)
+            PeeringSession.objects.create(
+                autonomous_system=autonomous_system, internet_exchange=ixp,
+                ip_address='192.168.{}.1'.format(i))
+
+        bgp_neighbors_detail = {'global': {64500: [
+            {'remote_address': '192.168.{}.1'.format(i),
+             'connection_state': 'Established',
+             'received_prefix_count': 10,
+             'advertised_prefix_count': 20} for i in range(2)
+        ]}}
+
+        # The router is polled only once for both IXs
+        with patch.object(Router, 'get_napalm_bgp_neighbors_detail',
+                          return_value=bgp_neighbors_detail) as poll:
+            call_command('update_peering_session_states', timeout=5)
+            poll.assert_called_once_with(timeout=5)
+
+        self.assertEqual(['established', 'established'], list(
+            PeeringSession.objects.values_list('bgp_state', flat=True)))
+
+        # A router which does not answer is given up
+        released = threading.Event()
+        self.addCleanup(released.set)
+        PeeringSession.objects.update(bgp_state='idle')
+        with patch.object(Router, 'get_napalm_bgp_neighbors_detail',
+                          side_effect=lambda timeout: released.wait(10)), \
+                patch('logging.shutdown'), \
+                patch('os._exit', side_effect=SystemExit) as exit:
+            with self.assertRaises(SystemExit):
+                call_command('update_peering_session_states', timeout=1)
+            exit.assert_called_once_with(1)
+        self.assertEqual(['idle', 'idle'], list(
+            PeeringSession.objects.values_list('bgp_state', flat=True)))
+
+    def test_deploy_configurations_command(self):
+        router = Router.objects.create(name='Test', hostname='test.example',
+                                       platform=PLATFORM_JUNOS)
+        for i in range(2):
+            template = ConfigurationTemplate.objects.create(
+                name='Test {}'.format(i), template='ix {}'.format(i))
+            InternetExchange.objects.create(
+                name='Test {}'.format(i), slug='test_{}'.format(i),
+                router=router, configuration_template=template)
+        InternetExchange.objects.create(name='No router', slug='no_router',
+                                        configuration_template=template)
+
+        # Both configurations are merged in a single candidate
+        with patch.object(Router, 'set_napalm_configuration',
+                          return_value='diff') as deploy:
+            out = StringIO()
+            call_command('deploy_configurations', stdout=out)
+            deploy.assert_called_once()
+            self.assertEqual('ix 0\nix 1', ''.join(deploy.call_args[0][0]))
+            self.assertEqual({'commit': True, 'timeout': None},
+                             deploy.call_args[1])
+
+        self.assertEqual('Test: changed (Test 0, Test 1)\n', out.getvalue())
+
+        # Nothing to deploy if nothing changed since the last deployment
+        with patch.object(Router, 'set_napalm_configuration',
+                          return_value='') as deploy:
+            call_command('deploy_configurations', stdout=StringIO())
+            deploy.assert_not_called()
+
+            # Changes not in the configuration are ignored
+            ixp = InternetExchange.objects.get(slug='test_0')
+            ixp.comment = 'Changed'
+            ixp.save()
+            call_command('deploy_configurations', stdout=StringIO())
+            deploy.assert_not_called()
+
+            ixp.configuration_template.template = \
+                'ix {{ internet_exchange.comment }}'
+            ixp.configuration_template.save()
+            call_command('deploy_configurations', stdout=StringIO())
+            deploy.assert_called_once()
+            self.assertEqual('ix Changed', ''.join(deploy.call_args[0][0]))
+
+            call_command('deploy_configurations', force=True,
+                         stdout=StringIO())
+            self.assertEqual(2, deploy.call_count)
+
+        # A router which does not answer is given up
+        released = threading.Event()
+        self.addCleanup(released.set)
+        with patch.object(Router, 'set_napalm_configuration',
+                          side_effect=lambda *args, **kwargs: released.wait(
+                              10)), \
+                patch('logging.shutdown'), \
+                patch('os._exit', side_effect=SystemExit) as exit:
+            out = StringIO()
+            with self.assertRaises(SystemExit):
+                call_command('deploy_configurations', force=True, timeout=1,
+                             stdout=out)
+            exit.assert_called_once_with(1)
+        self.assertEqual('Test: failed (Test 0, Test 1)\n', out.getvalue())
+
     def test_generate_configuration(self):
         expected = [
             {
@@ -551,9 +874,64 @@ class InternetExchangeTestCase(TestCase):
                 internet_exchange=internet_exchange,
                 ip_address='2001:db8::{}'.format(i)
             )
-        values = internet_exchange._generate_configuration_variables()
+        # Sessions with their ASes and communities, whatever their numbers
+        with self.assertNumQueries(2):
+            values = internet_exchange._generate_configuration_variables()
         self.assertEqual(values['peering_groups'], expected)
 
+        # The hash is the one of the rendered configuration
+        internet_exchange.configuration_template = \
+            ConfigurationTemplate.objects.create(
+                name='Test', template='{{ peering_groups|length }}')
+        internet_exchange.save()
+        self.assertEqual('2', internet_exchange.generate_configuration())
+        self.assertEqual(hashlib.sha256(b'2').hexdigest(),
+                         internet_exchange.get_configuration_hash())
+
+        # Rendered piece by piece, the hash is known once done
+        internet_exchange.configuration_template.template = \
+            '{% for i in range(10) %}{{ i }}{% endfor %}'
+        self.assertEqual(
+            ['0123', '4567', '89'],
+            list(internet_exchange.generate_configuration_stream(4)))
+        self.assertEqual(hashlib.sha256(b'0123456789').hexdigest(),
+                         internet_exchange.get_configuration_hash())
+
+        # Anything the template reads changes the hash
+        internet_exchange.configuration_template.template = \
+            '{{ internet_exchange.router.hostname }}'
+        internet_exchange._configuration_hash = None
+        configuration_hash = internet_exchange.get_configuration_hash()
+        internet_exchange.router = Router.objects.create(
+            name='Test', hostname='test.example')
+        internet_exchange._configuration_hash = None
+        self.assertNotEqual(configuration_hash,
+                            internet_exchange.get_configuration_hash())
+
+        # IPv4 sessions use their own maximum prefixes
+        autonomous_system = AutonomousSystem.objects.get(asn=1)
+        autonomous_system.ipv4_max_prefixes = 100
+        autonomous_system.save()
+        PeeringSession.objects.create(
+            autonomous_system=autonomous_system,
+            internet_exchange=internet_exchange, ip_address='192.168.0.1',
+            password='secret', enabled=False)
+        community = Community.objects.create(name='Test', value='64500:1')
+        internet_exchange.communities.add(community)
+
+        values = internet_exchange._generate_configuration_variables()
+        self.assertEqual(expected[0], values['peering_groups'][0])
+        self.assertEqual(
+            {'ip_version': 4, 'peers': {1: {
+                'as_name': 'Test 1',
+                'max_prefixes': 100,
+                'sessions': [{'ip_address': '192.168.0.1',
+                              'password': 'secret',
+                              'enabled': False}]
+            }}}, values['peering_groups'][1])
+        self.assertEqual([{'name': 'Test', 'value': '64500:1'}],
+                         values['communities'])
+
 
 class InternetExchangeViewsTestCase(ViewTestCase):
     def setUp(self):
@@ -719,8 +1097,119 @@ class InternetExchangeViewsTestCase(ViewTestCase):
                          params={'slug': 'not-found'},
                          expected_status_code=404)
 
+    def test_ix_configuration_download_view(self):
+        # Not logged in, no right to access the view, should be redirected
+        self.get_request('peering:ix_configuration_download',
+                         params={'slug': self.slug}, expected_status_code=302)
+
+        # Authenticate and retry, no template attached
+        self.authenticate_user()
+        self.get_request('peering:ix_configuration_download',
+                         params={'slug': self.slug}, expected_status_code=404)
+
+        self.ix.configuration_template = ConfigurationTemplate.objects.create(
+            name='Test', template='{{ internet_exchange.name }}')
+        self.ix.save()
+        response = self.client.get(reverse('peering:ix_configuration_download',
+                                           kwargs={'slug': self.slug}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.name,
+                         b''.join(response.streaming_content).decode())
+
+    def test_async_router_save_view(self):
+        self.ix.configuration_template = ConfigurationTemplate.objects.create(
+            name='Test', template='{{ internet_exchange.name }}')
+        self.ix.router = Router.objects.create(
+            name='Test', hostname='test.example', platform=PLATFORM_JUNOS)
+        self.ix.save()
+
+        # The configuration is sent while it is rendered
+        with patch.object(Router, 'set_napalm_configuration',
+                          return_value='diff') as deploy:
+            self.get_request('peering:async_router_save',
+                             params={'slug': self.slug},
+                             contains='"success": true')
+            self.assertEqual(self.name, ''.join(deploy.call_args[0][0]))
+
+            # Not sent again if already deployed
+            self.get_request('peering:async_router_save',
+                             params={'slug': self.slug},
+                             contains='"success": true')
+            deploy.assert_called_once()
+
+    def test_ix_configuration_view(self):
+        self.ix.configuration_template = ConfigurationTemplate.objects.create(
+            name='Test', template='{{ internet_exchange.name }}')
+        self.ix.save()
+        self.authenticate_user()
+        self.get_request('peering:ix_configuration',
+                         params={'slug': self.slug},
+                         contains='<code>{}</code>'.format(self.name))
+
+        # Not rendered if the IX has too many sessions
+        with patch.object(IXConfig, 'max_displayed_sessions', -1), \
+                patch.object(InternetExchange,
+                             'generate_configuration') as generate:
+            self.get_request('peering:ix_configuration',
+                             params={'slug': self.slug},
+                             contains='too large to be displayed')
+            generate.assert_not_called()
+
 
 class PeeringSessionTestCase(TestCase):
+    def test_get_from_peeringdb_peer_records(self):
+        # Our own IX network, the IX is linked to it
+        NetworkIXLAN.objects.create(id=1, asn=settings.MY_ASN, name='Us',
+                                    ipaddr4='192.0.2.254', ix_id=1,
+                                    ixlan_id=1)
+        internet_exchange = InternetExchange.objects.create(
+            name='Test', slug='test', peeringdb_id=1)
+        existing = PeeringSession.objects.create(
+            autonomous_system=AutonomousSystem.objects.create(asn=64500,
+                                                              name='Test'),
+            internet_exchange=internet_exchange, ip_address='2001:db8::1')
+
+        for i in range(5):
+            Network.objects.create(id=i + 1, asn=64500 + i,
+                                   name='Test {}'.format(i))
+            NetworkIXLAN.objects.create(
+                id=i + 2, asn=64500 + i, name='Test {}'.format(i),
+                ipaddr6='2001:db8::{}'.format(i + 1),
+                ipaddr4='192.0.2.{}'.format(i + 1), ix_id=1, ixlan_id=1)
+        # Peer on an IX we are not connected to
+        Network.objects.create(id=6, asn=64505, name='Test 5')
+        NetworkIXLAN.objects.create(id=7, asn=64505, name='Test 5',
+                                    ipaddr6='2001:db8:1::1', ix_id=2,
+                                    ixlan_id=2)
+
+        peer_records = list(PeerRecord.objects.select_related(
+            'network', 'network_ixlan').order_by('network__asn'))
+        self.assertEqual(6, len(peer_records))
+
+        # IX map, ASes (and the missing ones, in a savepoint), existing
+        # sessions
+        with self.assertNumQueries(8):
+            sessions = PeeringSession.get_from_peeringdb_peer_records(
+                peer_records)
+
+        self.assertEqual(10, len(sessions))
+        self.assertEqual((existing, False), sessions[0])
+        self.assertEqual('192.0.2.1', sessions[1][0].ip_address)
+        self.assertTrue(all([created for _, created in sessions[1:]]))
+        self.assertEqual(5, AutonomousSystem.objects.count())
+        self.assertEqual(
+            [internet_exchange],
+            list(set([session.internet_exchange for session, _ in sessions])))
+
+        # Single peer record and IP version
+        session, created = PeeringSession.get_from_peeringdb_peer_record(
+            peer_records[1], 4)
+        self.assertTrue(created)
+        self.assertEqual('192.0.2.2', session.ip_address)
+        self.assertEqual((None, False),
+                         PeeringSession.get_from_peeringdb_peer_record(
+                             peer_records[5], 6))
+
     def test_does_exist(self):
         # No session, must expect None
         self.assertIsNone(PeeringSession.does_exist())
@@ -864,6 +1353,51 @@ class PeeringSessionViewsTestCase(ViewTestCase):
         self.get_request('peering:peering_session_bulk_delete',
                          expected_status_code=302)
 
+    def get_formset_data(self, sessions):
+        data = {
+            'form-TOTAL_FORMS': len(sessions),
+            'form-INITIAL_FORMS': len(sessions),
+        }
+        for i, session in enumerate(sessions):
+            for name, value in session.items():
+                data['form-{}-{}'.format(i, name)] = value
+
+        return data
+
+    def test_peering_session_add_from_peeringdb_view(self):
+        self.authenticate_user()
+        path = reverse('peering:peering_session_add_from_peeringdb')
+
+        sessions = [{
+            'autonomous_system': self.as64500.pk,
+            'internet_exchange': self.ix.pk,
+            'ip_address': '2001:db8::64:{}'.format(i),
+            'enabled': 'True',
+        } for i in range(20)]
+
+        # The AS and the IX are retrieved once for all forms, the sessions are
+        # created at once and a single action is logged
+        data = self.get_formset_data(sessions)
+        response = self.client.post(path, data)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(21, PeeringSession.objects.count())
+        self.assertEqual(1, UserAction.objects.filter(
+            message='Imported 20 peering sessions').count())
+
+        sessions = [dict(session, ip_address='2001:db8::65:{}'.format(i))
+                    for i, session in enumerate(sessions)]
+        # Session and user, AS and IX, the sessions (and a savepoint) and the
+        # action, whatever the number of forms
+        with self.assertNumQueries(8):
+            self.client.post(path, self.get_formset_data(sessions))
+        self.assertEqual(41, PeeringSession.objects.count())
+
+        # Invalid forms are reported as usual
+        sessions[0]['ip_address'] = 'invalid'
+        response = self.client.post(path, self.get_formset_data(sessions))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(41, PeeringSession.objects.count())
+
 
 class RouterTestCase(TestCase):
     def test_napalm_bgp_neighbors_to_peer_list(self):
@@ -904,6 +1438,139 @@ class RouterTestCase(TestCase):
                                  napalm_dicts_list[i])))
 
 
+class RouterNapalmConfigurationTestCase(TestCase):
+    def test_set_napalm_configuration_with_chunks(self):
+        router = Router.objects.create(name='test',
+                                       hostname='test.example.com',
+                                       platform=PLATFORM_JUNOS)
+        candidates = []
+
+        def set_napalm_configuration(candidate, commit, timeout):
+            with open(candidate['filename']) as config_file:
+                candidates.append(config_file.read())
+            return 'diff'
+
+        router._set_napalm_configuration = set_napalm_configuration
+        self.assertEqual('diff', router.set_napalm_configuration(
+            (chunk for chunk in ['set ', 'system'])))
+        self.assertEqual(['set system'], candidates)
+
+
+class FakeDevice(object):
+    def __init__(self):
+        self.alive = True
+        self.opened = False
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def is_alive(self):
+        return {'is_alive': self.alive}
+
+
+class NapalmConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self.router = Router.objects.create(name='test',
+                                            hostname='test.example.com',
+                                            platform=PLATFORM_JUNOS)
+        self.devices = []
+
+        def get_napalm_device(timeout=None):
+            self.devices.append(FakeDevice())
+            return self.devices[-1]
+
+        self.router.get_napalm_device = get_napalm_device
+
+    def test_connection_error(self):
+        pool = NapalmConnectionPool(max_connections=1, wait_timeout=0)
+
+        def get_napalm_device(timeout=None):
+            raise ValueError()
+
+        self.router.get_napalm_device = get_napalm_device
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                with pool.connection(self.router):
+                    pass
+
+    def test_connection_timeout(self):
+        pool = NapalmConnectionPool()
+
+        # Only reused with the timeout it was opened with
+        with pool.connection(self.router, timeout=5) as device:
+            pass
+        with pool.connection(self.router, timeout=10) as other_device:
+            self.assertIsNot(device, other_device)
+        with pool.connection(self.router, timeout=5) as other_device:
+            self.assertIs(device, other_device)
+        self.assertEqual(2, len(self.devices))
+
+        pool.close_all()
+
+    def test_connection_reuse(self):
+        pool = NapalmConnectionPool()
+
+        with pool.connection(self.router) as device:
+            self.assertTrue(device.opened)
+        with pool.connection(self.router) as device:
+            self.assertIs(self.devices[0], device)
+        self.assertEqual(1, len(self.devices))
+
+        # Dead connections are replaced
+        self.devices[0].alive = False
+        with pool.connection(self.router) as device:
+            self.assertIs(self.devices[1], device)
+        self.assertFalse(self.devices[0].opened)
+
+        # Connections used when an error occurred are closed
+        with self.assertRaises(ValueError):
+            with pool.connection(self.router) as device:
+                raise ValueError()
+        self.assertFalse(self.devices[1].opened)
+
+        pool.close_all()
+
+    def test_idle_timeout(self):
+        pool = NapalmConnectionPool(idle_timeout=0)
+
+        with pool.connection(self.router):
+            pass
+        with pool.connection(self.router):
+            pass
+        self.assertEqual(2, len(self.devices))
+        self.assertFalse(self.devices[0].opened)
+
+    def test_idle_connections_closed(self):
+        pool = NapalmConnectionPool(idle_timeout=0.1)
+
+        # Closed in background even if the pool is not used anymore
+        with pool.connection(self.router):
+            pass
+        reaper = pool.reaper
+        self.assertTrue(self.devices[0].opened)
+        reaper.join(5)
+        self.assertFalse(reaper.is_alive())
+        self.assertFalse(self.devices[0].opened)
+        self.assertIsNone(pool.reaper)
+
+    def test_max_connections(self):
+        pool = NapalmConnectionPool(max_connections=1, wait_timeout=0)
+
+        with pool.connection(self.router) as device:
+            self.assertIsNotNone(device)
+            with pool.connection(self.router) as other_device:
+                self.assertIsNone(other_device)
+
+        with pool.connection(self.router) as device:
+            self.assertIsNotNone(device)
+
+        pool.close_all()
+        self.assertFalse(self.devices[0].opened)
+
+
 class RouterViewsTestCase(ViewTestCase):
     def setUp(self):
         super(RouterViewsTestCase, self).setUp()
@@ -1018,3 +1685,305 @@ class RouterViewsTestCase(ViewTestCase):
         # Not logged in, no right to access the view, should be redirected
         self.get_request('peering:router_bulk_delete',
                          expected_status_code=302)
+
+
+class CSVRecordValidatorTestCase(TestCase):
+    def test_validate(self):
+        router = Router.objects.create(name='test', hostname='test.example')
+        InternetExchange.objects.create(name='Test', slug='test')
+        validator = CSVRecordValidator(InternetExchangeCSVForm)
+
+        records = [(i, {'name': 'IX {}'.format(i),
+                        'slug': 'ix-{}'.format(i),
+                        'router': str(router.pk)}) for i in range(1, 11)]
+        records.append((11, {'name': 'Test', 'slug': 'test',
+                             'router': str(router.pk)}))
+        records.append((12, {'name': 'IX', 'slug': 'ix',
+                             'ipv4_address': 'invalid'}))
+
+        # The router is retrieved only once and slugs are checked at once
+        with self.assertNumQueries(2):
+            instances, errors = validator.validate(records)
+
+        self.assertEqual(10, len(instances))
+        self.assertEqual(router, instances[0].router)
+        self.assertEqual(2, len(errors))
+        self.assertEqual((11, 'slug'), errors[0][:2])
+        self.assertEqual((12, 'ipv4_address'), errors[1][:2])
+
+        # Slugs already seen in a previous batch are reported
+        instances, errors = validator.validate([(13, {'name': 'IX 1',
+                                                      'slug': 'ix-1'})])
+        self.assertEqual([], instances)
+        self.assertEqual((13, 'slug'), errors[0][:2])
+
+    def test_validate_with_form_validation(self):
+        class InternetExchangeForm(InternetExchangeCSVForm):
+            def clean_name(self):
+                if self.cleaned_data['name'] == 'Invalid':
+                    raise ValidationError('Invalid name.')
+                return self.cleaned_data['name']
+
+        self.assertFalse(has_custom_validation(InternetExchangeCSVForm))
+        self.assertTrue(has_custom_validation(InternetExchangeForm))
+        self.assertTrue(has_custom_validation(formset_factory(
+            InternetExchangeForm, formset=InternetExchangePeeringDBFormSet)))
+
+        # Records are validated by the form
+        validator = CSVRecordValidator(InternetExchangeForm)
+        instances, errors = validator.validate([
+            (1, {'name': 'IX', 'slug': 'ix'}),
+            (2, {'name': 'Invalid', 'slug': 'invalid'}),
+            (3, {'name': 'IX', 'slug': 'ix'}),
+        ])
+        self.assertEqual(['ix'], [instance.slug for instance in instances])
+        self.assertEqual([(2, 'name', 'Invalid name.'), (3, 'slug')],
+                         [errors[0], errors[1][:2]])
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(),
+                                 'peering_manager_tests_cache'),
+    }
+})
+class StatisticsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_cache_not_shared(self):
+        AutonomousSystem.objects.create(asn=64500, name='Test')
+
+        # Values are not cached in a cache local to the process
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertFalse(is_cache_shared())
+            self.assertEqual(['peering.W001'],
+                             [error.id for error in check_cache(None)])
+            with self.assertNumQueries(2):
+                self.assertEqual(1, get_statistics()['as_count'])
+                get_statistics()
+
+        self.assertTrue(is_cache_shared())
+        self.assertEqual([], check_cache(None))
+
+    def test_get_statistics(self):
+        AutonomousSystem.objects.create(asn=64500, name='Test')
+
+        # One query to count everything, none once cached
+        with self.assertNumQueries(1):
+            statistics = get_statistics()
+        self.assertEqual(1, statistics['as_count'])
+        self.assertEqual(0, statistics['peering_sessions_count'])
+        with self.assertNumQueries(0):
+            get_statistics()
+
+        # Updates do not change counters
+        autonomous_system = AutonomousSystem.objects.get(asn=64500)
+        autonomous_system.name = 'Changed'
+        autonomous_system.save()
+        with self.assertNumQueries(0):
+            get_statistics()
+
+        # Creations and deletions do
+        router = Router.objects.create(name='Test', hostname='test.example')
+        self.assertEqual(1, get_statistics()['routers_count'])
+        router.delete()
+        self.assertEqual(0, get_statistics()['routers_count'])
+
+        # Objects created without signals
+        AutonomousSystem.objects.bulk_create([
+            AutonomousSystem(asn=64501, name='Test 1')])
+        self.assertEqual(1, get_statistics()['as_count'])
+        invalidate_statistics()
+        self.assertEqual(2, get_statistics()['as_count'])
+
+    def test_get_history(self):
+        self.assertEqual([], get_history())
+        with self.assertNumQueries(0):
+            get_history()
+
+        # Logging an action invalidates the history
+        user = User.objects.create_user(username='test')
+        UserAction.objects.log_create(user, user, 'Test')
+        self.assertEqual(1, len(get_history()))
+
+
+class TemplateCacheTestCase(TestCase):
+    def setUp(self):
+        self.configuration_template = ConfigurationTemplate.objects.create(
+            name='Test', template='{{ value }}')
+
+    def test_get_template(self):
+        cache = TemplateCache(size=1)
+
+        template = cache.get_template(self.configuration_template)
+        self.assertEqual('1', template.render(value=1))
+        self.assertIs(template,
+                      cache.get_template(self.configuration_template))
+
+        # Edited templates are compiled again
+        self.configuration_template.template = '{{ value }}!'
+        self.configuration_template.save()
+        template = cache.get_template(self.configuration_template)
+        self.assertEqual('1!', template.render(value=1))
+
+        # Least recently used templates are evicted
+        other_template = ConfigurationTemplate.objects.create(
+            name='Other', template='')
+        cache.get_template(other_template)
+        self.assertEqual(1, len(cache.templates))
+        self.assertIsNot(template,
+                         cache.get_template(self.configuration_template))
+
+    def test_bytecode_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            TemplateCache(directory=directory).get_template(
+                self.configuration_template)
+            self.assertEqual(1, len(os.listdir(directory)))
+
+            # Another process can load the compiled template from the disk
+            template = TemplateCache(directory=directory).get_template(
+                self.configuration_template)
+            self.assertEqual('1', template.render(value=1))
+            self.assertEqual(1, len(os.listdir(directory)))
+        finally:
+            shutil.rmtree(directory)
+
+
+class ListViewsQueriesTestCase(ViewTestCase):
+    def setUp(self):
+        super(ListViewsQueriesTestCase, self).setUp()
+
+        # Our own IX network, needed to find available peers
+        NetworkIXLAN.objects.create(id=1, asn=settings.MY_ASN, name='Us',
+                                    ipaddr4='192.168.0.1', ix_id=1,
+                                    ixlan_id=1)
+        self.internet_exchange = InternetExchange.objects.create(
+            name='Test', slug='test', peeringdb_id=1)
+        self.autonomous_system = self.add_objects(1)
+
+        # Show all columns
+        self.authenticate_user()
+
+    def add_objects(self, number):
+        start = AutonomousSystem.objects.count()
+
+        for i in range(start, start + number):
+            asn = 64500 + i
+            name = 'Test {}'.format(i)
+            autonomous_system = AutonomousSystem.objects.create(asn=asn,
+                                                                name=name)
+            Community.objects.create(name=name, value='64500:{}'.format(i))
+            internet_exchange = InternetExchange.objects.create(
+                name=name, slug='test_{}'.format(i),
+                configuration_template=ConfigurationTemplate.objects.create(
+                    name=name, template=''),
+                router=Router.objects.create(name=name,
+                                             hostname='test.example',
+                                             platform=PLATFORM_JUNOS))
+
+            for ix in [self.internet_exchange, internet_exchange]:
+                PeeringSession.objects.create(
+                    autonomous_system=autonomous_system, internet_exchange=ix,
+                    ip_address='192.168.1.{}'.format(i + 1))
+
+            # Creating the IX network also creates the peer record
+            Network.objects.create(id=i + 1, asn=asn, name=name)
+            NetworkIXLAN.objects.create(
+                id=i + 2, asn=asn, name=name,
+                ipaddr4='192.168.2.{}'.format(i + 1), ix_id=1, ixlan_id=1)
+
+        return autonomous_system
+
+    def assertConstantQueries(self, path, params={}):
+        # Do not use counts cached by the keyset pagination
+        cache.clear()
+        expected = self.get_request_query_count(path, params=params)
+        self.add_objects(3)
+        cache.clear()
+        self.assertEqual(expected,
+                         self.get_request_query_count(path, params=params))
+
+    def test_as_list_view(self):
+        self.assertConstantQueries('peering:as_list')
+
+    def test_as_peering_sessions_view(self):
+        self.assertConstantQueries(
+            'peering:as_peering_sessions',
+            params={'asn': self.autonomous_system.asn})
+
+    def test_community_list_view(self):
+        self.assertConstantQueries('peering:community_list')
+
+    def test_configuration_template_list_view(self):
+        self.assertConstantQueries('peering:configuration_template_list')
+
+    def test_ix_list_view(self):
+        self.assertConstantQueries('peering:ix_list')
+
+    def test_ix_peering_sessions_view(self):
+        self.assertConstantQueries('peering:ix_peering_sessions',
+                                   params={'slug': self.internet_exchange.slug})
+
+    def test_ix_peers_view(self):
+        self.assertConstantQueries('peering:ix_peers',
+                                   params={'slug': self.internet_exchange.slug})
+
+    def test_peering_session_list_view(self):
+        self.assertConstantQueries('peering:peering_session_list')
+
+    def test_router_list_view(self):
+        self.assertConstantQueries('peering:router_list')
+
+    def test_peering_session_add_from_peeringdb_view(self):
+        path = reverse('peering:peering_session_add_from_peeringdb')
+
+        def post():
+            data = {'pk': PeerRecord.objects.values_list('pk', flat=True)}
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(path, data)
+            self.assertEqual(200, response.status_code)
+            # Choices shared by all forms still show the selected values
+            self.assertContains(
+                response, '<option value="{}" selected>'.format(
+                    self.internet_exchange.pk))
+            return len(context.captured_queries)
+
+        # Selecting more peers does not need more queries
+        expected = post()
+        self.add_objects(3)
+        self.assertEqual(expected, post())
+
+    def test_keyset_pagination(self):
+        self.add_objects(2)
+        path = reverse('peering:ix_peering_sessions',
+                       kwargs={'slug': self.internet_exchange.slug})
+
+        # Sessions ordered by ASN, two per page
+        response = self.client.get(path, {'per_page': 2})
+        page = response.context['table'].keyset_page
+        self.assertEqual([64500, 64501], [
+            session.autonomous_system.asn for session in page])
+        self.assertTrue(page.has_next())
+        self.assertContains(response, 'Showing 2 of about 3')
+
+        response = self.client.get(path, {'per_page': 2,
+                                          'after': page.next_cursor()})
+        page = response.context['table'].keyset_page
+        self.assertEqual([64502], [
+            session.autonomous_system.asn for session in page])
+        self.assertFalse(page.has_next())
+
+        response = self.client.get(path, {'per_page': 2,
+                                          'before': page.previous_cursor()})
+        page = response.context['table'].keyset_page
+        self.assertEqual([64500, 64501], [
+            session.autonomous_system.asn for session in page])
+
+        # Sorting by another column uses the regular pagination
+        response = self.client.get(path, {'sort': '-ip_address'})
+        self.assertFalse(hasattr(response.context['table'], 'keyset_page'))
@@ -79,6 +79,8 @@ urlpatterns = [
         views.IXPeers.as_view(), name='ix_peers'),
     url(r'^ix/(?P<slug>[\w-]+)/config/$',
         views.IXConfig.as_view(), name='ix_configuration'),
+    url(r'^ix/(?P<slug>[\w-]+)/config/download/$',
+        views.IXConfigDownload.as_view(), name='ix_configuration_download'),
     url(r'^ix/(?P<slug>[\w-]+)/update_session_states/$',
         views.IXUpdateSessionStates.as_view(),
         name='ix_update_session_states'),
@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.template.defaultfilters import slugify
 from django.views.generic import View
@@ -147,6 +147,7 @@ class ASPeeringSessions(ModelListView):
     filter_form = PeeringSessionFilterFormForAS
     table = PeeringSessionTableForAS
     template = 'peering/as/sessions.html'
+    keyset_pagination = True
 
     def build_queryset(self, request, kwargs):
         queryset = None
@@ -157,7 +158,7 @@ class ASPeeringSessions(ModelListView):
             autonomous_system = get_object_or_404(
                 AutonomousSystem, asn=kwargs['asn'])
             queryset = autonomous_system.peeringsession_set.order_by(
-                'internet_exchange', 'ip_address')
+                'internet_exchange__name', 'ip_address')
 
         return queryset
 
@@ -432,6 +433,7 @@ class IXPeeringSessions(ModelListView):
     filter_form = PeeringSessionFilterFormForIX
     table = PeeringSessionTableForIX
     template = 'peering/ix/sessions.html'
+    keyset_pagination = True
 
     def build_queryset(self, request, kwargs):
         queryset = None
@@ -442,7 +444,7 @@ class IXPeeringSessions(ModelListView):
             internet_exchange = get_object_or_404(
                 InternetExchange, slug=kwargs['slug'])
             queryset = internet_exchange.peeringsession_set.order_by(
-                'autonomous_system.asn', 'ip_address')
+                'autonomous_system__asn', 'ip_address')
 
         return queryset
 
@@ -477,6 +479,7 @@ class IXPeers(ModelListView):
     filter_form = PeerRecordFilterForm
     table = PeerRecordTable
     template = 'peering/ix/peers.html'
+    keyset_pagination = True
 
     def build_queryset(self, request, kwargs):
         queryset = None
@@ -505,17 +508,42 @@ class IXPeers(ModelListView):
 
 
 class IXConfig(LoginRequiredMixin, View):
+    # Configurations of IXs with more sessions are too large to be displayed,
+    # they are not rendered and only available for download
+    max_displayed_sessions = 1000
+
     def get(self, request, slug):
         internet_exchange = get_object_or_404(InternetExchange, slug=slug)
 
+        configuration = None
+        if internet_exchange.peeringsession_set.count() <= \
+                self.max_displayed_sessions:
+            configuration = internet_exchange.generate_configuration()
+
         context = {
             'internet_exchange': internet_exchange,
-            'internet_exchange_configuration': internet_exchange.generate_configuration(),
+            'internet_exchange_configuration': configuration,
         }
 
         return render(request, 'peering/ix/configuration.html', context)
 
 
+class IXConfigDownload(LoginRequiredMixin, View):
+    def get(self, request, slug):
+        internet_exchange = get_object_or_404(InternetExchange, slug=slug)
+        if not internet_exchange.configuration_template:
+            raise Http404('No configuration template for this IX.')
+
+        # Send the configuration while it is rendered
+        response = StreamingHttpResponse(
+            internet_exchange.generate_configuration_stream(),
+            content_type='text/plain')
+        response['Content-Disposition'] = 'attachment; filename="{}.conf"'.format(
+            internet_exchange.slug)
+
+        return response
+
+
 class IXUpdateSessionStates(LoginRequiredMixin, View):
     def get(self, request, slug):
         internet_exchange = get_object_or_404(InternetExchange, slug=slug)
@@ -533,11 +561,13 @@ class IXUpdateSessionStates(LoginRequiredMixin, View):
 
 
 class PeeringSessionList(ModelListView):
-    queryset = PeeringSession.objects.order_by('autonomous_system')
+    queryset = PeeringSession.objects.order_by('autonomous_system__asn',
+                                               'ip_address')
     table = PeeringSessionTable
     filter = PeeringSessionFilter
     filter_form = PeeringSessionFilterForm
     template = 'peering/session/list.html'
+    keyset_pagination = True
 
 
 class PeeringSessionAdd(AddOrEditView):
@@ -588,19 +618,15 @@ class PeeringSessionAddFromPeeringDB(BulkAddFromDependencyView):
     form_model = PeeringSessionForm
     template = 'peering/session/add_from_peeringdb.html'
 
-    def process_dependency_object(self, dependency):
-        session6, created6 = PeeringSession.get_from_peeringdb_peer_record(
-            dependency, 6)
-        session4, created4 = PeeringSession.get_from_peeringdb_peer_record(
-            dependency, 4)
-        return_value = []
-
-        if session6:
-            return_value.append(session6)
-        if session4:
-            return_value.append(session4)
+    def get_dependency_objects(self, pk_list):
+        return list(self.dependency_model.objects.filter(
+            pk__in=pk_list).select_related('network', 'network_ixlan'))
 
-        return return_value
+    def process_dependency_objects(self, dependencies):
+        # Resolve all peer records at once instead of one IP version of one
+        # peer record at a time
+        return [[session for session, _ in
+                 PeeringSession.get_from_peeringdb_peer_records(dependencies)]]
 
     def sort_objects(self, object_list):
         objects = []
@@ -708,7 +734,11 @@ class AsyncRouterDiff(View):
     def get(self, request, slug):
         internet_exchange = get_object_or_404(InternetExchange, slug=slug)
         changes = internet_exchange.router.set_napalm_configuration(
-            internet_exchange.generate_configuration())
+            internet_exchange.generate_configuration_stream())
+
+        # The router configuration does not match the deployed one anymore
+        if changes and internet_exchange.is_configuration_deployed():
+            internet_exchange.set_configuration_deployed(False)
 
         return HttpResponse(json.dumps({
             'changed': True if changes else False,
@@ -719,8 +749,18 @@ class AsyncRouterDiff(View):
 class AsyncRouterSave(View):
     def get(self, request, slug):
         internet_exchange = get_object_or_404(InternetExchange, slug=slug)
+        # Only rendered if it has to be sent to the router
+        configuration = internet_exchange.generate_configuration_stream()
+
+        # No need to talk to the router if nothing changed since the last
+        # successful commit
+        if internet_exchange.is_configuration_deployed():
+            return HttpResponse(json.dumps({'success': True}))
+
         changes = internet_exchange.router.set_napalm_configuration(
-            internet_exchange.generate_configuration(), True)
+            configuration, True)
+        if changes is not None:
+            internet_exchange.set_configuration_deployed()
 
         return HttpResponse(json.dumps({
             'success': True if changes else False,
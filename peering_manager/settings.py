@@ -32,7 +32,32 @@ try:
     NAPALM_PASSWORD = getattr(configuration, 'NAPALM_PASSWORD', '')
     NAPALM_TIMEOUT = getattr(configuration, 'NAPALM_TIMEOUT', 30)
     NAPALM_ARGS = getattr(configuration, 'NAPALM_ARGS', {})
+    NAPALM_POOL_IDLE_TIMEOUT = getattr(configuration,
+                                       'NAPALM_POOL_IDLE_TIMEOUT', 60)
+    NAPALM_POOL_MAX_CONNECTIONS = getattr(configuration,
+                                          'NAPALM_POOL_MAX_CONNECTIONS', 2)
+    CONFIGURATION_TEMPLATE_CACHE_SIZE = getattr(
+        configuration, 'CONFIGURATION_TEMPLATE_CACHE_SIZE', 128)
+    CONFIGURATION_TEMPLATE_CACHE_DIRECTORY = getattr(
+        configuration, 'CONFIGURATION_TEMPLATE_CACHE_DIRECTORY', None)
     PAGINATE_COUNT = getattr(configuration, 'PAGINATE_COUNT', 20)
+    PEERINGDB_API_RETRIES = getattr(configuration, 'PEERINGDB_API_RETRIES',
+                                    3)
+    PEERINGDB_API_BACKOFF_FACTOR = getattr(configuration,
+                                           'PEERINGDB_API_BACKOFF_FACTOR', 0.5)
+    PEERINGDB_CACHE_DIRECTORY = getattr(configuration,
+                                        'PEERINGDB_CACHE_DIRECTORY', None)
+    PEERINGDB_SYNC_BATCH_SIZE = getattr(configuration,
+                                        'PEERINGDB_SYNC_BATCH_SIZE', 500)
+    CACHES = getattr(configuration, 'CACHES', {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    STATISTICS_CACHE_TIMEOUT = getattr(configuration,
+                                       'STATISTICS_CACHE_TIMEOUT', 300)
+    USER_ACTION_BUFFER_SIZE = getattr(configuration,
+                                      'USER_ACTION_BUFFER_SIZE', 500)
     TIME_ZONE = getattr(configuration, 'TIME_ZONE', 'UTC')
     MY_ASN = getattr(configuration, 'MY_ASN', -1)
     NO_CONFIG_FILE = False
@@ -50,6 +75,7 @@ except ImportError:
     ALLOWED_HOSTS = ['*']
     TIME_ZONE = 'UTC'
     PAGINATE_COUNT = 20
+    USER_ACTION_BUFFER_SIZE = 500
     NO_CONFIG_FILE = True
 
 VERSION = '0.99-dev'
@@ -110,6 +136,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'utils.middleware.RequireLoginMiddleware',
+    'utils.middleware.UserActionBufferMiddleware',
 ]
 
 ROOT_URLCONF = 'peering_manager.urls'
@@ -16,11 +16,8 @@ from django.utils.http import is_safe_url
 from django.views.generic import View
 
 from .forms import LoginForm, UserPasswordChangeForm, SetupForm
-from peering.models import (AutonomousSystem, Community,
-                            ConfigurationTemplate, InternetExchange,
-                            PeeringSession, Router)
-from peeringdb.models import Synchronization
-from utils.models import UserAction
+from peering.statistics import (get_history, get_statistics,
+                                get_synchronizations)
 
 from django.conf import settings
 
@@ -63,18 +60,10 @@ class Home(View):
     def get(self, request):
         if settings.NO_CONFIG_FILE:
             return redirect('setup')
-        statistics = {
-            'as_count': AutonomousSystem.objects.count(),
-            'ix_count': InternetExchange.objects.count(),
-            'communities_count': Community.objects.count(),
-            'config_templates_count': ConfigurationTemplate.objects.count(),
-            'routers_count': Router.objects.count(),
-            'peering_sessions_count': PeeringSession.objects.count(),
-        }
         context = {
-            'statistics': statistics,
-            'history': UserAction.objects.select_related('user')[:50],
-            'synchronizations': Synchronization.objects.all()[:5],
+            'statistics': get_statistics(),
+            'history': get_history(),
+            'synchronizations': get_synchronizations(),
         }
         return render(request, 'home.html', context)
 
@@ -1,15 +1,24 @@
 from __future__ import unicode_literals
 
+import codecs
+import itertools
 import json
 import logging
-import requests
+import os
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db import transaction
+from django.db.models import Q
 from django.conf import settings
-from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .client import get_client
 from .models import Network, NetworkIXLAN, PeerRecord, Prefix, Synchronization
+from utils.db import bulk_update
 
 
 NAMESPACES = {
@@ -24,6 +33,8 @@ NAMESPACES = {
     'organization': 'org',
     'network_contact': 'poc',
 }
+# Size in bytes of the chunks read when streaming JSON data
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class Object(object):
@@ -32,21 +43,155 @@ class Object(object):
     """
 
     def __init__(self, data):
-        self.__dict__ = json.loads(json.dumps(data))
+        self.__dict__.update(data)
 
     def __str__(self):
         return str(self.__dict__)
 
 
+class JSONStreamReader(object):
+    """
+    Class used to read JSON values one by one from an iterable of chunks
+    (bytes or strings). Consumed data are dropped from the buffer so that only
+    the value being decoded is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    whitespaces = ' \t\n\r'
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.unicode_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _fill(self):
+        """
+        Adds the next chunk to the buffer. Returns False if there was no more
+        data to read.
+        """
+        if self.eof:
+            return False
+
+        # Drop data that have already been consumed
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            chunk = self.unicode_decoder.decode(b'', final=True)
+
+        if isinstance(chunk, bytes):
+            chunk = self.unicode_decoder.decode(chunk)
+        self.buffer += chunk
+
+        return True
+
+    def peek(self):
+        """
+        Returns the next character which is not a whitespace without consuming
+        it. None is returned if the end of the data has been reached.
+        """
+        while True:
+            while (self.position < len(self.buffer) and
+                   self.buffer[self.position] in self.whitespaces):
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+
+            if not self._fill():
+                return None
+
+    def expect(self, *characters):
+        """
+        Consumes the next character which is not a whitespace and returns it.
+        A ValueError is raised if it is not one of the expected characters.
+        """
+        character = self.peek()
+        if character not in characters:
+            raise ValueError('expected one of "{}" but found "{}"'.format(
+                ''.join(characters), character))
+
+        self.position += 1
+        return character
+
+    def decode(self):
+        """
+        Decodes and returns the next JSON value.
+        """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer,
+                                                     self.position)
+            except ValueError:
+                # The value is probably truncated, try again with more data
+                if not self._fill():
+                    raise
+                continue
+
+            # A value ending the buffer can be truncated (e.g. a number)
+            if end == len(self.buffer) and self._fill():
+                continue
+
+            self.position = end
+            return value
+
+
+def iter_json_array(chunks, key='data'):
+    """
+    Incrementally parses a JSON object given as an iterable of chunks and
+    yields, one by one, the items of the array found under the given key.
+    """
+    reader = JSONStreamReader(chunks)
+    reader.expect('{')
+
+    while reader.peek() != '}':
+        name = reader.decode()
+        reader.expect(':')
+
+        if name != key:
+            # Not the array we are looking for, just skip the value
+            reader.decode()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield reader.decode()
+                    if reader.expect(',', ']') == ']':
+                        break
+
+        if reader.peek() == ',':
+            reader.expect(',')
+
+
+def iter_json_file(path, key='data'):
+    """
+    Yields, one by one, the items of the array found under the given key of
+    the JSON object stored in a file.
+    """
+    with open(path, 'rb') as dump:
+        for item in iter_json_array(
+                iter(lambda: dump.read(STREAM_CHUNK_SIZE), b''), key):
+            yield item
+
+
 class PeeringDB(object):
     """
     Class used to interact with the PeeringDB API.
     """
     logger = logging.getLogger('peering.manager.peeringdb')
 
-    def lookup(self, namespace, search):
+    def _get_api_url(self, namespace, search):
         """
-        Sends a get request to the API given a namespace and some parameters.
+        Returns the URL of the API for a given namespace and adds the default
+        parameters to the search if needed.
         """
         # Enforce trailing slash and add namespace
         api_url = settings.PEERINGDB_API.strip('/') + '/' + namespace
@@ -55,11 +200,89 @@ class PeeringDB(object):
         if 'depth' not in search:
             search['depth'] = 1
 
-        # Make the request
         self.logger.debug('calling api: %s | %s', api_url, search)
-        response = requests.get(api_url, params=search)
+        return api_url
 
-        return response.json() if response.status_code == 200 else None
+    def _get(self, namespace, search, stream=False):
+        """
+        Sends a get request to the API given a namespace and some parameters
+        and returns the response.
+        """
+        return get_client().get(self._get_api_url(namespace, search),
+                                params=search, stream=stream)
+
+    def lookup(self, namespace, search):
+        """
+        Sends a get request to the API given a namespace and some parameters.
+        """
+        return get_client().get_json(self._get_api_url(namespace, search),
+                                     params=search)
+
+    def stream_lookup(self, namespace, search):
+        """
+        Sends a get request to the API given a namespace and some parameters.
+        Returns an iterator yielding objects as soon as they are read from the
+        response instead of loading the whole response at once. None is
+        returned if the request failed.
+        """
+        response = self._get(namespace, search, stream=True)
+
+        if response.status_code != 200:
+            response.close()
+            return None
+
+        def iter_objects():
+            try:
+                for data in iter_json_array(response.iter_content(
+                        chunk_size=STREAM_CHUNK_SIZE)):
+                    yield data
+            finally:
+                response.close()
+
+        return iter_objects()
+
+    def download_namespace(self, namespace, search, path):
+        """
+        Downloads the objects of a namespace matching the given parameters and
+        writes the raw JSON response in a file. Returns True if the download
+        was successful, False in any other cases.
+        """
+        response = self._get(namespace, search, stream=True)
+
+        try:
+            if response.status_code != 200:
+                return False
+
+            with open(path, 'wb') as dump:
+                for chunk in response.iter_content(
+                        chunk_size=STREAM_CHUNK_SIZE):
+                    dump.write(chunk)
+        finally:
+            response.close()
+
+        self.logger.debug('downloaded %s namespace to %s', namespace, path)
+        return True
+
+    def download_namespaces(self, last_sync, namespaces, directory):
+        """
+        Downloads the changes since the last sync of several namespaces at the
+        same time. Each namespace is written in a JSON file named after it
+        inside the given directory.
+
+        This function returns a dict telling for each namespace if its
+        download was successful.
+        """
+        with ThreadPoolExecutor(max_workers=len(namespaces)) as executor:
+            futures = {
+                namespace: executor.submit(
+                    self.download_namespace, namespace,
+                    {'since': last_sync, 'depth': 0},
+                    os.path.join(directory, '{}.json'.format(namespace)))
+                for namespace in namespaces
+            }
+
+        return {namespace: future.result()
+                for namespace, future in futures.items()}
 
     def record_last_sync(self, time, objects_changes):
         """
@@ -101,7 +324,86 @@ class PeeringDB(object):
 
         return int(last_sync_time)
 
-    def synchronize_objects(self, last_sync, namespace, model):
+    def _synchronize_batch(self, batch, model):
+        """
+        Writes a batch of PeeringDB objects to the local database. Existing
+        objects are found with a single query, then the objects are written
+        using bulk operations (one for deletions, one for updates and one for
+        creations).
+
+        This function returns a tuple with the number of objects that have
+        been added, updated and deleted.
+        """
+        verbose_name = model._meta.verbose_name.lower()
+        field_names = [field.attname for field in model._meta.concrete_fields
+                       if not field.is_relation]
+
+        # Get IDs of the objects already known locally
+        existing_ids = set(model.objects.filter(
+            pk__in=[data['id'] for data in batch]).values_list('pk',
+                                                               flat=True))
+
+        objects_to_create = []
+        objects_to_update = []
+        objects_to_delete = []
+
+        for data in batch:
+            # Object marked as deleted so remove it locally too, there is no
+            # point of creating it if it does not exist
+            if data['status'] == 'deleted':
+                if data['id'] in existing_ids:
+                    objects_to_delete.append(data['id'])
+                continue
+
+            # Set the value for each field
+            local_object = model(**{field_name: data.get(field_name)
+                                    for field_name in field_names})
+
+            # Uniqueness cannot be checked object per object without issuing
+            # queries, the database will enforce it anyway
+            try:
+                local_object.full_clean(validate_unique=False)
+            except ValidationError:
+                self.logger.error(
+                    'bug found? error while validating id: %s for model: %s',
+                    data['id'], verbose_name)
+                continue
+
+            if local_object.pk in existing_ids:
+                objects_to_update.append(local_object)
+            else:
+                objects_to_create.append(local_object)
+
+        # Deletions come first in case a new object replaces a deleted one
+        if objects_to_delete:
+            model.objects.filter(pk__in=objects_to_delete).delete()
+            self.logger.debug('deleted %s %s from local database',
+                              len(objects_to_delete), verbose_name)
+
+        if objects_to_update:
+            bulk_update(model, objects_to_update,
+                        [field_name for field_name in field_names
+                         if field_name != model._meta.pk.attname])
+            self.logger.debug('updated %s %s from peeringdb',
+                              len(objects_to_update), verbose_name)
+
+        if objects_to_create:
+            model.objects.bulk_create(objects_to_create)
+            self.logger.debug('created %s %s from peeringdb',
+                              len(objects_to_create), verbose_name)
+
+        # Objects are not saved one by one, so peer records have to be
+        # maintained for the whole batch
+        if model is NetworkIXLAN:
+            self.update_peer_records(
+                [network_ixlan.pk for network_ixlan in
+                 objects_to_update + objects_to_create])
+
+        return (len(objects_to_create), len(objects_to_update),
+                len(objects_to_delete))
+
+    def synchronize_objects(self, last_sync, namespace, model,
+                            batch_size=None, dump_file=None):
         """
         Synchronizes all the objects of a namespace of the PeeringDB to the
         local database. This function is meant to be run regularly to update
@@ -113,6 +415,12 @@ class PeeringDB(object):
         If the object is marked as deleted in the PeeringDB, it will be locally
         deleted.
 
+        Objects are written by batches of the given size (or of the size
+        defined by the PEERINGDB_SYNC_BATCH_SIZE setting), each batch using a
+        fixed number of queries. Objects are streamed from the API (or from
+        the given JSON dump file) so only one batch is kept in memory at a
+        time.
+
         This function returns the number of objects that have been successfully
         synchronized to the local database.
         """
@@ -120,85 +428,53 @@ class PeeringDB(object):
         objects_updated = 0
         objects_deleted = 0
 
-        # Get all network changes since the last sync
-        search = {'since': last_sync, 'depth': 0}
-        result = self.lookup(namespace, search)
+        if dump_file:
+            # Get all objects from a file, usually a full namespace dump
+            objects = iter_json_file(dump_file)
+        else:
+            # Get all network changes since the last sync
+            search = {'since': last_sync, 'depth': 0}
+            objects = self.stream_lookup(namespace, search)
 
-        if not result:
+        if objects is None:
             return None
 
-        for data in result['data']:
-            peeringdb_object = Object(data)
-            marked_as_deleted = peeringdb_object.status == 'deleted'
-            marked_as_new = False
-
-            try:
-                # Get the local object by its ID
-                local_object = model.objects.get(pk=peeringdb_object.id)
-
-                # Object marked as deleted so remove it locally too
-                if marked_as_deleted:
-                    local_object.delete()
-                    objects_deleted += 1
-                    self.logger.debug('deleted %s #%s from local database',
-                                      model._meta.verbose_name.lower(),
-                                      peeringdb_object.id)
-                    continue
-            except model.DoesNotExist:
-                # Local object does not exist so create it
-                local_object = model()
-                marked_as_new = True
-
-            # Set the value for each field
-            for model_field in model._meta.get_fields():
-                field_name = model_field.name
-
-                # Do not try to follow foreign keys
-                if model_field.get_internal_type() == 'ForeignKey':
-                    continue
-
-                value = getattr(peeringdb_object, field_name)
-
-                try:
-                    field = local_object._meta.get_field(field_name)
-                except FieldDoesNotExist:
-                    field = None
-                    self.logger.error('bug found? field: %s for model: %s',
-                                      field_name,
-                                      model._meta.verbose_name.lower())
-
-                if field:
-                    setattr(local_object, field_name, value)
+        if not batch_size:
+            batch_size = settings.PEERINGDB_SYNC_BATCH_SIZE
 
-            try:
-                local_object.full_clean()
-            except ValidationError:
-                self.logger.error(
-                    'bug found? error while validating id: %s for model: %s',
-                    peeringdb_object.id, model._meta.verbose_name.lower())
-                continue
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, batch_size))
+            if not batch:
+                break
 
-            # Save the local object
-            local_object.save()
+            added, updated, deleted = self._synchronize_batch(batch, model)
 
             # Update counters
-            if marked_as_new:
-                objects_added += 1
-                self.logger.debug('created %s #%s from peeringdb',
-                                  model._meta.verbose_name.lower(),
-                                  local_object.id)
-            else:
-                objects_updated += 1
-                self.logger.debug('updated %s #%s from peeringdb',
-                                  model._meta.verbose_name.lower(),
-                                  local_object.id)
+            objects_added += added
+            objects_updated += updated
+            objects_deleted += deleted
 
         return (objects_added, objects_updated, objects_deleted)
 
-    def update_local_database(self, last_sync):
+    def update_local_database(self, last_sync, dump_directory=None,
+                              parallel=False):
         """
         Update the local database by synchronizing all PeeringDB API's
         namespaces that we are actually caring about.
+
+        If a dump directory is given, objects are read from the JSON files
+        named after each namespace (e.g. net.json) it contains instead of being
+        fetched from the API.
+
+        If parallel is True, all namespaces are downloaded at the same time
+        into temporary files before being written to the local database. The
+        writes are still done in a single transaction, one namespace after
+        the other.
+
+        A RuntimeError is raised, and nothing is written, if a namespace
+        cannot be synchronized so that its changes are not skipped by the
+        next synchronization.
         """
         # Set time of sync
         time_of_sync = timezone.now()
@@ -209,14 +485,44 @@ class PeeringDB(object):
         ]
         list_of_changes = []
 
-        # Make a single transaction, avoid too much database commits (poor
-        # speed) and fail the whole synchronization if something goes wrong
-        with transaction.atomic():
-            # Try to sync objects
-            for (namespace, object_type) in objects_to_sync:
-                changes = self.synchronize_objects(
-                    last_sync, namespace, object_type)
-                list_of_changes.append(changes)
+        # Download all namespaces at once, the network being the bottleneck
+        download_directory = None
+        if parallel and not dump_directory:
+            download_directory = tempfile.mkdtemp(prefix='peeringdb-')
+            dump_directory = download_directory
+
+        try:
+            if download_directory:
+                downloaded = self.download_namespaces(
+                    last_sync, [namespace for namespace, _ in objects_to_sync],
+                    download_directory)
+
+            # Make a single transaction, avoid too much database commits (poor
+            # speed) and fail the whole synchronization if something goes
+            # wrong
+            with transaction.atomic():
+                # Try to sync objects
+                for (namespace, object_type) in objects_to_sync:
+                    changes = None
+                    if not download_directory or downloaded[namespace]:
+                        dump_file = os.path.join(
+                            dump_directory, '{}.json'.format(
+                                namespace)) if dump_directory else None
+                        changes = self.synchronize_objects(
+                            last_sync, namespace, object_type,
+                            dump_file=dump_file)
+
+                    if changes is None:
+                        self.logger.error('unable to synchronize %s namespace',
+                                          namespace)
+                        raise RuntimeError(
+                            'Unable to synchronize the {} namespace.'.format(
+                                namespace))
+
+                    list_of_changes.append(changes)
+        finally:
+            if download_directory:
+                shutil.rmtree(download_directory, ignore_errors=True)
 
         objects_changes = {
             'added': sum(added for added, _, _ in list_of_changes),
@@ -227,42 +533,91 @@ class PeeringDB(object):
         # Save the last sync time
         self.record_last_sync(time_of_sync, objects_changes)
 
+    def update_peer_records(self, network_ixlan_ids):
+        """
+        Reconciles the peer records of the given network IX LANs using a fixed
+        number of queries. Missing peer records are created and peer records
+        which are no longer valid (the ASN or the IP addresses of the network
+        IX LAN changed) are deleted.
+        """
+        if not network_ixlan_ids:
+            return
+
+        # Peer records that are expected to exist
+        network_ixlans = dict(NetworkIXLAN.objects.filter(
+            Q(pk__in=network_ixlan_ids) &
+            (Q(ipaddr6__isnull=False) | Q(ipaddr4__isnull=False))
+        ).values_list('id', 'asn'))
+        networks = dict(Network.objects.filter(
+            asn__in=set(network_ixlans.values())).values_list('asn', 'id'))
+        expected = set((networks[asn], network_ixlan_id)
+                       for network_ixlan_id, asn in network_ixlans.items()
+                       if asn in networks)
+
+        # Peer records that actually exist
+        existing = {}
+        for pk, network_id, network_ixlan_id in PeerRecord.objects.filter(
+                network_ixlan_id__in=network_ixlan_ids).values_list(
+                    'id', 'network_id', 'network_ixlan_id'):
+            existing[(network_id, network_ixlan_id)] = pk
+
+        stale = [pk for key, pk in existing.items() if key not in expected]
+        if stale:
+            PeerRecord.objects.filter(pk__in=stale).delete()
+
+        missing = [PeerRecord(network_id=network_id,
+                              network_ixlan_id=network_ixlan_id)
+                   for network_id, network_ixlan_id in expected
+                   if (network_id, network_ixlan_id) not in existing]
+        PeerRecord.objects.bulk_create(missing)
+
+        self.logger.debug('%s peer records created, %s peer records deleted',
+                          len(missing), len(stale))
+
     def force_peer_records_discovery(self):
         """
         Force the peer records cache to be [re]built. This function can be used
         if this cache appears to be out of sync or inconsistent.
+
+        Networks are mapped to their ASNs with a single query, then peer
+        records are created by batches, so the number of queries does not
+        depend on the number of network IX LANs.
         """
+        batch_size = settings.PEERINGDB_SYNC_BATCH_SIZE
+
         with transaction.atomic():
             # First of all, delete all existing peer records
             PeerRecord.objects.all().delete()
 
+            # Map ASNs to network IDs
+            networks = dict(Network.objects.values_list('asn', 'id'))
+
+            # Ignore network IX LANs without IPv6 and IPv4 to peer with
+            network_ixlans = NetworkIXLAN.objects.filter(
+                Q(ipaddr6__isnull=False) | Q(ipaddr4__isnull=False)
+            ).values_list('id', 'asn')
+
             # Build the cache
-            for network_ixlan in NetworkIXLAN.objects.all():
-                # Ignore if we have no IPv6 and no IPv4 to peer with
-                if not network_ixlan.ipaddr6 and not network_ixlan.ipaddr4:
-                    self.logger.debug('network ixlan with as%s and ixlan id %s'
-                                      ' ignored, no ipv6 and no ipv4',
-                                      network_ixlan.asn,
-                                      network_ixlan.ixlan_id)
+            peer_records = []
+            number_of_peer_records = 0
+            for network_ixlan_id, asn in network_ixlans.iterator():
+                if asn not in networks:
+                    self.logger.debug('unable to find network as%s', asn)
                     continue
 
-                network = None
-                try:
-                    network = Network.objects.get(asn=network_ixlan.asn)
-                except Network.DoesNotExist:
-                    self.logger.debug('unable to find network as%s',
-                                      network_ixlan.asn)
-
-                if network:
-                    PeerRecord.objects.create(network=network,
-                                              network_ixlan=network_ixlan)
-                    self.logger.debug('peer record with network as%s and ixlan'
-                                      'id %s created', network_ixlan.asn,
-                                      network_ixlan.ixlan_id)
-                else:
-                    self.logger.debug('network ixlan with as%s and ixlan id %s'
-                                      ' ignored', network_ixlan.asn,
-                                      network_ixlan.ixlan_id)
+                peer_records.append(PeerRecord(
+                    network_id=networks[asn],
+                    network_ixlan_id=network_ixlan_id))
+
+                if len(peer_records) >= batch_size:
+                    PeerRecord.objects.bulk_create(peer_records)
+                    number_of_peer_records += len(peer_records)
+                    peer_records = []
+
+            PeerRecord.objects.bulk_create(peer_records)
+            number_of_peer_records += len(peer_records)
+
+        self.logger.debug('%s peer records created', number_of_peer_records)
 
     def get_autonomous_system(self, asn):
         """
@@ -286,6 +641,38 @@ class PeeringDB(object):
 
         return network
 
+    def get_autonomous_systems(self, asns):
+        """
+        Return a dict mapping ASNs to their AS details. Details are taken from
+        the local database when possible, the ones missing from it are fetched
+        online with as few API calls as possible. ASNs without any PeeringDB
+        record are not part of the returned dict.
+        """
+        asns = list(set(asns))
+        networks = {}
+
+        # Keep the number of query parameters and the URL length reasonable
+        batch_size = 100
+        for i in range(0, len(asns), batch_size):
+            for network in Network.objects.filter(
+                    asn__in=asns[i:i + batch_size]):
+                networks[network.asn] = network
+
+        missing = [asn for asn in asns if asn not in networks]
+        for i in range(0, len(missing), batch_size):
+            search = {'asn__in': ','.join(
+                [str(asn) for asn in missing[i:i + batch_size]])}
+            result = self.lookup(NAMESPACES['network'], search)
+
+            if not result or not result['data']:
+                continue
+
+            for data in result['data']:
+                network = Object(data)
+                networks[network.asn] = network
+
+        return networks
+
     def get_ix_network(self, ix_network_id):
         """
         Return an IX networks (and its details) given its ID. The result can
@@ -331,6 +718,28 @@ class PeeringDB(object):
 
         return network_ixlans
 
+    def get_ix_networks_for_ixlan(self, ixlan_id):
+        """
+        Returns a list of all IX networks connected to an IX LAN.
+        """
+        # Try to get from cached data
+        network_ixlans = NetworkIXLAN.objects.filter(ixlan_id=ixlan_id)
+
+        # If nothing found in cache, try to fetch data online
+        if not network_ixlans:
+            search = {'ixlan_id': ixlan_id}
+            result = self.lookup(
+                NAMESPACES['network_internet_exchange_lan'], search)
+
+            if not result or not result['data']:
+                return None
+
+            network_ixlans = []
+            for ix_network in result['data']:
+                network_ixlans.append(Object(ix_network))
+
+        return network_ixlans
+
     def get_common_ix_networks_for_asns(self, asn1, asn2):
         """
         Returns a list of all common IX networks on which both ASNs are
@@ -348,13 +757,20 @@ class PeeringDB(object):
         if not asn1_network_ixlans or not asn2_network_ixlans:
             return common_network_ixlans
 
+        # Index IX LAN networks of asn2 by IX LAN to avoid comparing each
+        # couple of IX LAN networks
+        asn2_network_ixlans_by_ixlan = {}
+        for asn2_network_ixlan in asn2_network_ixlans:
+            asn2_network_ixlans_by_ixlan.setdefault(
+                asn2_network_ixlan.ixlan_id, []).append(asn2_network_ixlan)
+
         # Find IX LAN networks matching
         for asn1_network_ixlan in asn1_network_ixlans:
-            for asn2_network_ixlan in asn2_network_ixlans:
-                if asn1_network_ixlan.ixlan_id == asn2_network_ixlan.ixlan_id:
-                    # Keep track of the two IX LAN networks
-                    common_network_ixlans.append(
-                        (asn1_network_ixlan, asn2_network_ixlan))
+            for asn2_network_ixlan in asn2_network_ixlans_by_ixlan.get(
+                    asn1_network_ixlan.ixlan_id, []):
+                # Keep track of the two IX LAN networks
+                common_network_ixlans.append(
+                    (asn1_network_ixlan, asn2_network_ixlan))
 
         return common_network_ixlans
 
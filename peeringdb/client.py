@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+import requests
+import tempfile
+import threading
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django.conf import settings
+
+
+class HTTPClient(object):
+    """
+    Class used to send HTTP requests to the PeeringDB API.
+
+    It relies on a single session so connections are kept alive and reused
+    between requests. Compressed responses are requested, requests failing
+    with a 429 or 5xx status code are retried with an exponential backoff and,
+    if a cache directory is given, JSON responses are cached on disk and
+    revalidated using conditional requests (ETag and Last-Modified headers).
+    """
+    logger = logging.getLogger('peering.manager.peeringdb')
+    retry_status_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff_factor=0.5, cache_directory=None):
+        self.cache_directory = cache_directory
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip'})
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.retry_status_codes,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, params=None, stream=False):
+        """
+        Sends a get request and returns the response.
+        """
+        return self.session.get(url, params=params, stream=stream)
+
+    def _get_cache_path(self, url, params):
+        # Name the cache file after the full URL (including parameters)
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        return os.path.join(
+            self.cache_directory,
+            '{}.json'.format(hashlib.sha1(full_url.encode()).hexdigest()))
+
+    def _read_cache(self, path):
+        try:
+            with open(path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write_cache(self, path, entry):
+        if not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory)
+
+        # Write in a temporary file first, so a cache file is never partially
+        # written
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=self.cache_directory)
+        with os.fdopen(descriptor, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temporary_path, path)
+
+    def get_json(self, url, params=None):
+        """
+        Sends a get request and returns the decoded JSON response. None is
+        returned if the request was not successful.
+
+        If a cached response is found, the request is made conditional and the
+        cached response is returned if the server tells us that it is still
+        valid.
+        """
+        if not self.cache_directory:
+            response = self.get(url, params=params)
+            return response.json() if response.status_code == 200 else None
+
+        path = self._get_cache_path(url, params)
+        entry = self._read_cache(path)
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.session.get(url, params=params, headers=headers)
+
+        if response.status_code == 304 and entry:
+            self.logger.debug('using cached response for %s', response.url)
+            return entry['data']
+
+        if response.status_code != 200:
+            return None
+
+        data = response.json()
+
+        # Cache the response only if it can be revalidated later
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self._write_cache(path, {
+                'etag': etag,
+                'last_modified': last_modified,
+                'data': data,
+            })
+
+        return data
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the HTTP client shared by the whole process, creating it on first
+    use based on the settings.
+    """
+    global _client
+
+    with _client_lock:
+        if not _client:
+            _client = HTTPClient(
+                retries=settings.PEERINGDB_API_RETRIES,
+                backoff_factor=settings.PEERINGDB_API_BACKOFF_FACTOR,
+                cache_directory=settings.PEERINGDB_CACHE_DIRECTORY)
+
+    return _client
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from peeringdb.models import Network, NetworkIXLAN, PeerRecord, Prefix
+
+
+class Command(BaseCommand):
+    help = ('Show query plans and timings of the queries used to look up the '
+            'local PeeringDB cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=100,
+            help='Number of times each query is run to compute its timing.')
+        parser.add_argument(
+            '--without-indexes', action='store_true',
+            help='Also show the plans and timings of the queries without the '
+                 'indexes of the cache, which are dropped in a transaction '
+                 'rolled back afterwards.')
+
+    def drop_indexes(self):
+        """
+        Drops the indexes declared by the models of the cache, must be called
+        in a transaction which is rolled back.
+        """
+        # Not used as a context manager, SQLite cannot enter it in a
+        # transaction
+        schema_editor = connection.schema_editor(atomic=False)
+        with connection.cursor() as cursor:
+            for model in (NetworkIXLAN, Prefix):
+                for index in model._meta.indexes:
+                    cursor.execute(str(index.remove_sql(model,
+                                                        schema_editor)))
+
+    def show_plans(self, queries, iterations):
+        for name, queryset in queries:
+            duration = timeit.timeit(lambda: list(queryset.all()),
+                                     number=iterations)
+
+            self.stdout.write('\n{}'.format(name))
+            self.stdout.write('average time: {:.3f} ms'.format(
+                duration * 1000 / iterations))
+            self.stdout.write(queryset.explain())
+
+    def get_queries(self):
+        # Use real values found in the cache so the plans are realistic
+        sample = NetworkIXLAN.objects.exclude(ipaddr4__isnull=True).order_by(
+            '?').first()
+        if not sample:
+            return []
+        network = Network.objects.filter(asn=sample.asn).first()
+
+        queries = [
+            ('network ixlans for asn (get_ix_networks_for_asn)',
+             NetworkIXLAN.objects.filter(asn=sample.asn)),
+            ('network ixlans for ix (get_peers_for_ix)',
+             NetworkIXLAN.objects.filter(ix_id=sample.ix_id)),
+            ('network ixlan for ipv4 address',
+             NetworkIXLAN.objects.filter(ipaddr4=sample.ipaddr4)),
+            ('prefixes for ixlan (get_prefixes_for_ix_network)',
+             Prefix.objects.filter(ixlan_id=sample.ixlan_id)),
+            ('available peers (get_available_peers)',
+             PeerRecord.objects.filter(
+                 Q(network_ixlan__ix_id=sample.ix_id) &
+                 ~Q(network__asn=settings.MY_ASN) & (
+                     ~Q(network_ixlan__ipaddr6__in=[]) |
+                     ~Q(network_ixlan__ipaddr4__in=[sample.ipaddr4])
+                 )).order_by('network__asn')),
+        ]
+
+        if network:
+            queries.append(
+                ('peer record existence (NetworkIXLAN.save)',
+                 PeerRecord.objects.filter(network=network,
+                                           network_ixlan=sample)))
+
+        return queries
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if options['without_indexes'] and \
+                not connection.features.can_rollback_ddl:
+            raise CommandError('Indexes cannot be dropped in a transaction '
+                               'with this database.')
+
+        queries = self.get_queries()
+
+        if not queries:
+            self.stdout.write('The local PeeringDB cache is empty, run the '
+                              'peeringdb_sync command first.')
+            return
+
+        self.stdout.write('Cache size: {} networks, {} network ixlans, {} '
+                          'prefixes, {} peer records'.format(
+                              Network.objects.count(),
+                              NetworkIXLAN.objects.count(),
+                              Prefix.objects.count(),
+                              PeerRecord.objects.count()))
+
+        self.show_plans(queries, iterations)
+
+        if options['without_indexes']:
+            self.stdout.write('\nWithout indexes')
+            with transaction.atomic():
+                self.drop_indexes()
+                self.show_plans(queries, iterations)
+                transaction.set_rollback(True)
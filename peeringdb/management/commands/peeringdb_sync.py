@@ -11,8 +11,20 @@ class Command(BaseCommand):
     help = 'Sync known networks of PeeringDB.'
     logger = logging.getLogger('peering.manager.peeringdb')
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dump-directory',
+            help='Directory containing JSON dumps of the namespaces to sync '
+                 '(net.json, netixlan.json and ixpfx.json) to use instead of '
+                 'the PeeringDB API.')
+        parser.add_argument(
+            '--parallel', action='store_true',
+            help='Download all namespaces at the same time.')
+
     def handle(self, *args, **options):
         self.logger.info('Syncing networks with PeeringDB...')
 
         api = PeeringDB()
-        api.update_local_database(api.get_last_sync_time())
+        api.update_local_database(api.get_last_sync_time(),
+                                  dump_directory=options['dump_directory'],
+                                  parallel=options['parallel'])
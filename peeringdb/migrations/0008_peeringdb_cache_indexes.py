@@ -0,0 +1,66 @@
+# Generated by Django 2.1 on 2026-10-18 02:37
+
+from django.db import migrations, models
+
+
+def delete_duplicate_peer_records(apps, schema_editor):
+    """
+    Keeps only one peer record for each network and network IX LAN couple so
+    that the unique constraint can be created.
+    """
+    PeerRecord = apps.get_model('peeringdb', 'PeerRecord')
+    db_alias = schema_editor.connection.alias
+
+    seen = set()
+    duplicates = []
+    for pk, network_id, network_ixlan_id in PeerRecord.objects.using(
+            db_alias).order_by('pk').values_list('pk', 'network_id',
+                                                 'network_ixlan_id'):
+        if (network_id, network_ixlan_id) in seen:
+            duplicates.append(pk)
+        else:
+            seen.add((network_id, network_ixlan_id))
+
+    for i in range(0, len(duplicates), 500):
+        PeerRecord.objects.using(db_alias).filter(
+            pk__in=duplicates[i:i + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peeringdb', '0007_peerrecord'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_peer_records,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='peerrecord',
+            unique_together={('network', 'network_ixlan')},
+        ),
+        migrations.AddIndex(
+            model_name='networkixlan',
+            index=models.Index(fields=['asn'], name='peeringdb_n_asn_5fdf3d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkixlan',
+            index=models.Index(fields=['ipaddr6'], name='peeringdb_n_ipaddr6_6503ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkixlan',
+            index=models.Index(fields=['ipaddr4'], name='peeringdb_n_ipaddr4_3f6885_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkixlan',
+            index=models.Index(fields=['ix_id'], name='peeringdb_n_ix_id_02c44d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkixlan',
+            index=models.Index(fields=['ixlan_id'], name='peeringdb_n_ixlan_i_7e22e3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prefix',
+            index=models.Index(fields=['ixlan_id'], name='peeringdb_p_ixlan_i_b81d37_idx'),
+        ),
+    ]
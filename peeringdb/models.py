@@ -36,6 +36,13 @@ class NetworkIXLAN(models.Model):
 
     class Meta:
         ordering = ['asn', 'ipaddr6', 'ipaddr4']
+        indexes = [
+            models.Index(fields=['asn']),
+            models.Index(fields=['ipaddr6']),
+            models.Index(fields=['ipaddr4']),
+            models.Index(fields=['ix_id']),
+            models.Index(fields=['ixlan_id']),
+        ]
         verbose_name = 'Network IX LAN'
         verbose_name_plural = 'Network IX LANs'
 
@@ -88,6 +95,9 @@ class PeerRecord(models.Model):
     network = models.ForeignKey('Network', on_delete=models.CASCADE)
     network_ixlan = models.ForeignKey('NetworkIXLAN', on_delete=models.CASCADE)
 
+    class Meta:
+        unique_together = ('network', 'network_ixlan')
+
     def __str__(self):
         return 'AS{} ({}) on {}'.format(self.network.asn, self.network.name,
                                         self.network_ixlan.name)
@@ -100,6 +110,9 @@ class Prefix(models.Model):
 
     class Meta:
         ordering = ['prefix']
+        indexes = [
+            models.Index(fields=['ixlan_id']),
+        ]
         verbose_name = 'IX Prefix'
         verbose_name_plural = 'IX Prefixes'
 
@@ -1,10 +1,20 @@
 from __future__ import unicode_literals
 
+import json
+import shutil
+import tempfile
+
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
-from .api import PeeringDB
-from .models import Network, NetworkIXLAN
+from .api import PeeringDB, iter_json_array
+from .client import HTTPClient
+from .management.commands.peeringdb_query_plans import (
+    Command as QueryPlansCommand)
+from .models import Network, NetworkIXLAN, PeerRecord, Synchronization
 
 
 class PeeringDBTestCase(TestCase):
@@ -27,6 +37,160 @@ class PeeringDBTestCase(TestCase):
         self.assertEqual(api.get_last_sync_time(),
                          int(time_of_sync.timestamp()))
 
+    def test_synchronize_objects(self):
+        api = PeeringDB()
+        Network.objects.create(id=1, asn=64500, name='Network 1')
+        Network.objects.create(id=2, asn=64501, name='Network 2')
+        NetworkIXLAN.objects.create(id=1, asn=64501, name='IX', ix_id=1,
+                                    ixlan_id=1, ipaddr4='192.168.0.2')
+
+        def network(id, asn, status='ok'):
+            return {'id': id, 'asn': asn, 'name': 'Net {}'.format(id),
+                    'irr_as_set': None, 'info_prefixes6': 10,
+                    'info_prefixes4': 20, 'status': status}
+
+        # One new object, one updated object, one deleted object and one
+        # deleted object unknown locally
+        api.stream_lookup = lambda namespace, search: [
+            network(1, 64500), network(2, 64501, 'deleted'),
+            network(3, 64502), network(4, 64503, 'deleted'),
+        ]
+        self.assertEqual((1, 1, 1), api.synchronize_objects(
+            0, 'net', Network, batch_size=3))
+        self.assertEqual(['Net 1', 'Net 3'], list(
+            Network.objects.values_list('name', flat=True)))
+        self.assertEqual(10, Network.objects.get(pk=1).info_prefixes6)
+
+        # Network IX LANs synchronization must build peer records
+        api.stream_lookup = lambda namespace, search: [
+            {'id': 2, 'asn': 64502, 'name': 'IX', 'ipaddr6': '2001:db8::3',
+             'ipaddr4': None, 'is_rs_peer': True, 'ix_id': 1, 'ixlan_id': 1,
+             'status': 'ok'},
+        ]
+        self.assertEqual((1, 0, 0), api.synchronize_objects(
+            0, 'netixlan', NetworkIXLAN))
+        self.assertTrue(PeerRecord.objects.filter(
+            network__asn=64502, network_ixlan_id=2).exists())
+
+        # Peer records must follow the changes of network IX LANs
+        api.stream_lookup = lambda namespace, search: [
+            {'id': 1, 'asn': 64502, 'name': 'IX', 'ipaddr6': None,
+             'ipaddr4': '192.168.0.2', 'is_rs_peer': False, 'ix_id': 1,
+             'ixlan_id': 1, 'status': 'ok'},
+            {'id': 2, 'asn': 64502, 'name': 'IX', 'ipaddr6': None,
+             'ipaddr4': None, 'is_rs_peer': True, 'ix_id': 1, 'ixlan_id': 1,
+             'status': 'ok'},
+        ]
+        self.assertEqual((0, 2, 0), api.synchronize_objects(
+            0, 'netixlan', NetworkIXLAN))
+        self.assertEqual([(3, 1)], list(PeerRecord.objects.values_list(
+            'network_id', 'network_ixlan_id')))
+
+    def test_update_local_database_parallel(self):
+        api = PeeringDB()
+        dumps = {
+            'net': [{'id': 1, 'asn': 64500, 'name': 'Network 1',
+                     'irr_as_set': None, 'info_prefixes6': None,
+                     'info_prefixes4': None, 'status': 'ok'}],
+            'netixlan': [{'id': 1, 'asn': 64500, 'name': 'IX',
+                          'ipaddr6': None, 'ipaddr4': '192.168.0.1',
+                          'is_rs_peer': False, 'ix_id': 1, 'ixlan_id': 1,
+                          'status': 'ok'}],
+        }
+
+        def download_namespace(namespace, search, path):
+            if namespace not in dumps:
+                return False
+            with open(path, 'w') as dump:
+                json.dump({'data': dumps[namespace]}, dump)
+            return True
+
+        api.download_namespace = download_namespace
+
+        # Prefixes cannot be downloaded, nothing is synchronized so that the
+        # next synchronization does not skip them
+        with self.assertRaises(RuntimeError):
+            api.update_local_database(0, parallel=True)
+        self.assertEqual(0, Network.objects.count())
+        self.assertFalse(Synchronization.objects.exists())
+
+        dumps['ixpfx'] = []
+        api.update_local_database(0, parallel=True)
+
+        self.assertEqual(1, Network.objects.count())
+        self.assertEqual(1, NetworkIXLAN.objects.count())
+        self.assertEqual(1, PeerRecord.objects.count())
+        self.assertEqual(2, Synchronization.objects.get().added)
+
+    def test_force_peer_records_discovery(self):
+        api = PeeringDB()
+        Network.objects.create(id=1, asn=64500, name='Network 1')
+        Network.objects.create(id=2, asn=64501, name='Network 2')
+        for i, (asn, ipaddr4) in enumerate([(64500, '192.168.0.1'),
+                                            (64501, '192.168.0.2'),
+                                            (64501, None),
+                                            (64502, '192.168.0.3')]):
+            NetworkIXLAN.objects.create(id=i + 1, asn=asn, name='IX',
+                                        ipaddr4=ipaddr4, ix_id=1, ixlan_id=1)
+
+        # Start from an inconsistent cache
+        PeerRecord.objects.all().delete()
+        PeerRecord.objects.create(network_id=1, network_ixlan_id=2)
+
+        api.force_peer_records_discovery()
+        self.assertEqual([(1, 1), (2, 2)], sorted(
+            PeerRecord.objects.values_list('network_id', 'network_ixlan_id')))
+
+    def test_query_plans_command(self):
+        out = StringIO()
+        call_command('peeringdb_query_plans', stdout=out)
+        self.assertIn('cache is empty', out.getvalue())
+
+        Network.objects.create(id=1, asn=64500, name='Network 1')
+        Network.objects.create(id=2, asn=64501, name='Network 2')
+        for i, asn in enumerate([64500, 64501]):
+            NetworkIXLAN.objects.create(
+                id=i + 1, asn=asn, name='IX', ipaddr4='192.168.0.{}'.format(i),
+                ix_id=1, ixlan_id=2)
+        PeeringDB().force_peer_records_discovery()
+
+        out = StringIO()
+        call_command('peeringdb_query_plans', iterations=1, stdout=out)
+        self.assertIn('available peers', out.getvalue())
+
+        # Plans without indexes, which are then restored
+        out = StringIO()
+        call_command('peeringdb_query_plans', iterations=1,
+                     without_indexes=True, stdout=out)
+        with_indexes, without_indexes = out.getvalue().split(
+            'Without indexes')
+        self.assertIn('peeringdb_n_asn_5fdf3d_idx', with_indexes)
+        self.assertNotIn('peeringdb_n_asn_5fdf3d_idx', without_indexes)
+        self.assertIn('peeringdb_n_asn_5fdf3d_idx', str(
+            NetworkIXLAN.objects.filter(asn=64500).explain()))
+
+        # Queries look up the objects of the sample
+        queries = dict(QueryPlansCommand().get_queries())
+        self.assertTrue(
+            queries['available peers (get_available_peers)'].exists())
+
+    def test_iter_json_array(self):
+        document = ('{"meta": {"data": [0]}, "data": [{"id": 1, "name": '
+                    '"caf\u00e9"}, {"id": 22, "asn": 12345}, []] }')
+        expected = [{'id': 1, 'name': 'caf\u00e9'}, {'id': 22, 'asn': 12345},
+                    []]
+
+        # Parsing must not depend on how the data are split
+        encoded = document.encode('utf-8')
+        for size in [1, 2, 7, len(encoded)]:
+            chunks = [encoded[i:i + size]
+                      for i in range(0, len(encoded), size)]
+            self.assertEqual(expected, list(iter_json_array(chunks)))
+
+        self.assertEqual([], list(iter_json_array(['{"data": []}'])))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"data": [{"id": 1}']))
+
     def test_get_autonomous_system(self):
         api = PeeringDB()
         asn = 15169
@@ -112,6 +276,18 @@ class PeeringDBTestCase(TestCase):
 
         self.assertEqual(sorted(known_ix_networks), sorted(found_ix_networks))
 
+    def test_get_common_ix_networks_for_asns_with_cache(self):
+        api = PeeringDB()
+        for i, (asn, ixlan_id) in enumerate([(64500, 1), (64500, 2),
+                                             (64501, 2), (64501, 2),
+                                             (64501, 3)]):
+            NetworkIXLAN.objects.create(id=i + 1, asn=asn, name='IX',
+                                        ix_id=ixlan_id, ixlan_id=ixlan_id)
+
+        common = api.get_common_ix_networks_for_asns(64500, 64501)
+        self.assertEqual([(2, 3), (2, 4)], sorted(
+            (n1.id, n2.id) for n1, n2 in common))
+
     def test_get_prefixes_for_ix_network(self):
         api = PeeringDB()
         ix_network_id = 29146
@@ -137,3 +313,52 @@ class PeeringDBTestCase(TestCase):
 
         # Must have some peers
         self.assertEqual(len(api.get_peers_for_ix(ix_id)), 9)
+
+
+class HTTPClientTestCase(TestCase):
+    class FakeResponse(object):
+        def __init__(self, status_code, data=None, headers={}):
+            self.status_code = status_code
+            self.data = data
+            self.headers = headers
+            self.url = 'https://peeringdb.com/api/net'
+
+        def json(self):
+            return self.data
+
+    class FakeSession(object):
+        def __init__(self, responses):
+            self.responses = responses
+            self.requests = []
+
+        def get(self, url, params=None, headers=None, **kwargs):
+            self.requests.append(headers)
+            return self.responses.pop(0)
+
+    def setUp(self):
+        self.cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_directory)
+
+    def test_get_json_with_cache(self):
+        client = HTTPClient(cache_directory=self.cache_directory)
+        data = {'data': [{'asn': 64500}]}
+        client.session = self.FakeSession([
+            self.FakeResponse(200, data, {'ETag': '"v1"'}),
+            self.FakeResponse(304),
+            self.FakeResponse(404),
+        ])
+        url = 'https://peeringdb.com/api/net'
+
+        # First request is not conditional, response gets cached
+        self.assertEqual(data, client.get_json(url, {'asn': 64500}))
+        self.assertEqual({}, client.session.requests[0])
+
+        # Second request is conditional, cached response is used
+        self.assertEqual(data, client.get_json(url, {'asn': 64500}))
+        self.assertEqual({'If-None-Match': '"v1"'},
+                         client.session.requests[1])
+
+        # Errors are not hidden by the cache
+        self.assertIsNone(client.get_json(url, {'asn': 64500}))
@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+
+import threading
+
+from django.dispatch import Signal
+
+
+# Sent once buffered user actions have been written, bulk_create() does not
+# send post_save signals for each of them
+user_actions_flushed = Signal(providing_args=['actions'])
+
+_local = threading.local()
+
+
+class UserActionBuffer(object):
+    """
+    Collects user actions and writes them to the database with as few queries
+    as possible. Actions are written when the buffer is full and when it is
+    flushed, which is done when leaving the buffer used as a context manager.
+
+    While used as a context manager, the buffer receives the actions logged
+    with the UserAction manager by the current thread.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self.actions = []
+        self.previous = None
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __enter__(self):
+        self.previous = get_buffer()
+        _local.buffer = self
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.flush()
+        finally:
+            _local.buffer = self.previous
+            self.previous = None
+
+    def add(self, action):
+        self.actions.append(action)
+        if len(self.actions) >= self.size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered actions to the database and returns them.
+        """
+        actions, self.actions = self.actions, []
+        if not actions:
+            return actions
+
+        model = type(actions[0])
+        model._default_manager.bulk_create(actions, batch_size=self.size)
+        user_actions_flushed.send(sender=model, actions=actions)
+
+        return actions
+
+
+def get_buffer():
+    """
+    Returns the buffer collecting the actions logged by the current thread, or
+    None if actions must be written right away.
+    """
+    return getattr(_local, 'buffer', None)
@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+from django.db import connections
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+from django.dispatch import Signal
+
+
+# Sent by bulk_create(), Django does not send post_save signals when objects
+# are created by batches
+post_bulk_create = Signal(providing_args=['objects'])
+
+
+def bulk_create(model, objects, batch_size=None, using='default'):
+    """
+    Creates the given objects using as few queries as possible, and notifies
+    receivers of the post_bulk_create signal. The created objects are
+    returned, their primary keys are not set on every database backend.
+    """
+    objects = model._default_manager.using(using).bulk_create(
+        objects, batch_size=batch_size)
+    if objects:
+        post_bulk_create.send(sender=model, objects=objects, using=using)
+
+    return objects
+
+
+def bulk_update(model, objects, fields, batch_size=None, using='default'):
+    """
+    Updates the given fields of the given objects using as few queries as
+    possible. Each query is an UPDATE statement with a CASE expression mapping
+    primary keys to their new values.
+
+    Django only ships QuerySet.bulk_update() starting with version 2.2, this
+    function mimics its behaviour. As with its Django counterpart, the save()
+    method of the model is not called and signals are not sent.
+
+    The number of updated rows is returned.
+    """
+    objects = [obj for obj in objects if obj.pk is not None]
+    if not objects or not fields:
+        return 0
+
+    fields = [model._meta.get_field(name) for name in fields]
+    connection = connections[using]
+
+    # Two parameters per field and per object (primary key and value)
+    max_batch_size = connection.ops.bulk_batch_size(
+        ['pk', 'pk'] + fields, objects)
+    batch_size = min(batch_size, max_batch_size) if batch_size else \
+        max_batch_size
+    # PostgreSQL cannot guess the type of the CASE expression by itself
+    requires_casting = connection.vendor == 'postgresql'
+
+    updated = 0
+    for i in range(0, len(objects), batch_size):
+        batch = objects[i:i + batch_size]
+        values = {}
+
+        for field in fields:
+            when_statements = [
+                When(pk=obj.pk, then=Value(getattr(obj, field.attname),
+                                           output_field=field))
+                for obj in batch
+            ]
+            case_statement = Case(*when_statements, output_field=field)
+            if requires_casting:
+                case_statement = Cast(case_statement, output_field=field)
+            values[field.attname] = case_statement
+
+        updated += model._default_manager.using(using).filter(
+            pk__in=[obj.pk for obj in batch]).update(**values)
+
+    return updated
+
+
+def count_objects(models, using='default'):
+    """
+    Returns the number of objects of each given model, counting them with a
+    single query made of one subquery per model.
+    """
+    if not models:
+        return []
+
+    connection = connections[using]
+    subqueries = [
+        '(SELECT COUNT(*) FROM {})'.format(
+            connection.ops.quote_name(model._meta.db_table))
+        for model in models
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {}'.format(', '.join(subqueries)))
+        return list(cursor.fetchone())
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
+import codecs
 import csv
+import inspect
 
 from django import forms
 from django.conf import settings
@@ -41,35 +43,284 @@ class CSVDataField(forms.CharField):
             self.help_text = 'Enter the list of column headers followed by one record per line using commas to separate values.<br>Multi-line data and values containing commas have to be wrapped in double quotes.'
 
     def to_python(self, value):
+        if not value:
+            return []
+
         # Python 2 compatibility
         if not isinstance(value, str):
             value = value.encode('utf-8')
 
-        records = []
-        reader = csv.reader(value.splitlines())
+        return [record for _, record in read_csv_records(value.splitlines(),
+                                                         self.fields)]
+
+
+class CSVFileField(forms.FileField):
+    """
+    A CSV file upload. The file is not parsed when the form is validated, its
+    records have to be read lazily with the records() method so that big files
+    do not need to be loaded in memory.
+    """
+
+    def __init__(self, fields, *args, **kwargs):
+        self.fields = fields
 
-        # First line must be the headers
-        headers = next(reader)
-        for header in headers:
-            if header not in self.fields:
+        super(CSVFileField, self).__init__(*args, **kwargs)
+
+        if not self.label:
+            self.label = 'CSV File'
+        if not self.help_text:
+            self.help_text = 'UTF-8 encoded file, using the same format as CSV data. Large files should be imported this way.'
+
+    def records(self, value):
+        """
+        Yields the row number and the header/value mapping of each record of
+        the uploaded file.
+        """
+        value.seek(0)
+        return read_csv_records(codecs.iterdecode(value, 'utf-8'),
+                                self.fields)
+
+
+def read_csv_records(lines, fields):
+    """
+    Yields the row number and a dictionary with a header/value mapping for
+    each record found in the given CSV lines. The first line must contain the
+    headers, each one of them must be in the given fields.
+    """
+    reader = csv.reader(lines)
+
+    # First line must be the headers
+    headers = [header.strip() for header in next(reader, [])]
+    for header in headers:
+        if header not in fields:
+            raise forms.ValidationError(
+                'Unexpected column header "{}" found.'.format(header))
+
+    # Parse CSV data
+    for i, row in enumerate(reader, start=1):
+        if row:
+            # Number of columns in the row does not match the number of
+            # headers
+            if len(row) != len(headers):
                 raise forms.ValidationError(
-                    'Unexpected column header "{}" found.'.format(header))
-
-        # Parse CSV data
-        for i, row in enumerate(reader, start=1):
-            if row:
-                # Number of columns in the row does not match the number of
-                # headers
-                if len(row) != len(headers):
-                    raise forms.ValidationError(
-                        'Row {}: Expected {} columns but found {}'.format(i, len(headers), len(row)))
-
-                # Dissect the row and create a dictionary with it
-                row = [col.strip() for col in row]
-                record = dict(zip(headers, row))
-                records.append(record)
-
-        return records
+                    'Row {}: Expected {} columns but found {}'.format(i, len(headers), len(row)))
+
+            # Dissect the row and create a dictionary with it
+            row = [col.strip() for col in row]
+            yield i, dict(zip(headers, row))
+
+
+def has_custom_validation(form_class):
+    """
+    Tells if a form or formset class, or one of its parent classes outside of
+    Django, defines its own clean() or clean_<field>() methods.
+    """
+    for cls in inspect.getmro(form_class):
+        if cls.__module__.startswith('django.'):
+            continue
+        for name in vars(cls):
+            if name == 'clean' or name.startswith('clean_'):
+                return True
+
+    return False
+
+
+def share_formset_choices(formset):
+    """
+    Retrieves the choices of the model choice fields of a formset once for all
+    its forms, instead of once for each form when they are rendered.
+    """
+    forms_list = list(formset)
+    if not forms_list:
+        return
+
+    for name, field in forms_list[0].fields.items():
+        if isinstance(field, forms.ModelChoiceField):
+            choices = list(field.choices)
+            for form in forms_list:
+                form.fields[name].choices = choices
+
+
+class CSVRecordValidator(object):
+    """
+    Validates records (CSV rows or data submitted for the forms of a formset)
+    using the fields of a model form, without building a form for each record.
+    Records are validated by batches: related objects are retrieved and the
+    uniqueness of values is checked with one query per field and per batch.
+
+    If the form defines its own validation (clean() or clean_<field>()
+    methods), each record is validated with a form instead, only the
+    uniqueness of values is then checked by batches.
+    """
+
+    def __init__(self, form_model):
+        self.form_model = form_model
+        self.form_validation = has_custom_validation(form_model)
+        self.model = form_model._meta.model
+        self.fields = form_model().fields
+
+        model_fields = {field.name: field
+                        for field in self.model._meta.concrete_fields}
+        self.unique_fields = [name for name in self.fields
+                              if name in model_fields and
+                              model_fields[name].unique]
+        self.model_fields = [name for name in self.fields
+                             if name in model_fields]
+        # Related objects are already validated by their form fields
+        self.excluded_fields = [
+            name for name in model_fields if name not in self.fields or
+            isinstance(self.fields[name], forms.ModelChoiceField)
+        ]
+
+        # Values of unique fields already seen in previous records
+        self.seen_values = {name: set() for name in self.unique_fields}
+        self.related_objects = {}
+
+    def get_related_fields(self):
+        return [(name, field) for name, field in self.fields.items()
+                if isinstance(field, forms.ModelChoiceField) and
+                not isinstance(field, forms.ModelMultipleChoiceField)]
+
+    def prefetch_related_objects(self, records):
+        """
+        Retrieves the related objects referenced by the records with one query
+        per field.
+        """
+        for name, field in self.get_related_fields():
+            values = set([
+                field.widget.value_from_datadict(record, {}, name)
+                for _, record in records
+            ])
+            values = [value for value in values
+                      if value not in field.empty_values and
+                      (name, value) not in self.related_objects]
+            if not values:
+                continue
+
+            key = field.to_field_name or 'pk'
+            try:
+                related_objects = {
+                    str(getattr(related_object, key)): related_object
+                    for related_object in field.queryset.filter(**{
+                        '{}__in'.format(key): values
+                    })
+                }
+            except (TypeError, ValueError):
+                # Invalid values, errors are reported while cleaning them
+                continue
+
+            for value in values:
+                if str(value) in related_objects:
+                    self.related_objects[(name, value)] = (
+                        related_objects[str(value)], None)
+
+    def clean_field(self, name, field, record):
+        value = field.widget.value_from_datadict(record, {}, name)
+
+        if not isinstance(field, forms.ModelChoiceField) or \
+                isinstance(field, forms.ModelMultipleChoiceField):
+            return field.clean(value)
+
+        # Do not query the database again for an already known value
+        key = (name, value)
+        if key not in self.related_objects:
+            try:
+                self.related_objects[key] = (field.clean(value), None)
+            except forms.ValidationError as e:
+                self.related_objects[key] = (None, e)
+
+        related_object, error = self.related_objects[key]
+        if error:
+            raise error
+
+        return related_object
+
+    def clean_record(self, record):
+        """
+        Returns an unsaved object built with the record, and a dict mapping
+        field names to error messages.
+        """
+        if self.form_validation:
+            form = self.form_model(record)
+            if not form.is_valid():
+                return None, {name: messages[0]
+                              for name, messages in form.errors.items()}
+            return form.instance, {}
+
+        cleaned_data = {}
+        errors = {}
+
+        for name, field in self.fields.items():
+            try:
+                cleaned_data[name] = self.clean_field(name, field, record)
+            except forms.ValidationError as e:
+                errors[name] = e.messages[0]
+
+        if errors:
+            return None, errors
+
+        # Leave default values to fields without values, as model forms do
+        instance = self.model(**{
+            name: cleaned_data[name] for name in self.model_fields
+            if not self.model._meta.get_field(name).has_default() or
+            not self.fields[name].widget.value_omitted_from_data(
+                record, {}, name)
+        })
+
+        try:
+            instance.clean_fields(exclude=self.excluded_fields)
+        except forms.ValidationError as e:
+            errors.update({name: messages[0]
+                           for name, messages in e.message_dict.items()})
+
+        return instance, errors
+
+    def validate(self, records):
+        """
+        Validates a batch of (row, record) tuples. Returns the list of valid
+        unsaved objects and the list of (row, field, error) tuples describing
+        invalid records.
+        """
+        cleaned = []
+        errors = []
+
+        self.prefetch_related_objects(records)
+        for row, record in records:
+            instance, record_errors = self.clean_record(record)
+            if record_errors:
+                errors.extend([(row, name, error) for name, error
+                               in sorted(record_errors.items())])
+            else:
+                cleaned.append((row, instance))
+
+        # One query per unique field for the whole batch
+        existing_values = {}
+        for name in self.unique_fields:
+            values = [getattr(instance, name) for _, instance in cleaned]
+            existing_values[name] = set(
+                self.model._default_manager.filter(**{
+                    '{}__in'.format(name): values
+                }).order_by().values_list(name, flat=True))
+
+        instances = []
+        for row, instance in cleaned:
+            valid = True
+            for name in self.unique_fields:
+                value = getattr(instance, name)
+                if value is None:
+                    continue
+                if value in existing_values[name] or \
+                        value in self.seen_values[name]:
+                    valid = False
+                    errors.append((row, name, instance.unique_error_message(
+                        self.model, (name,)).messages[0]))
+                self.seen_values[name].add(value)
+
+            if valid:
+                instances.append(instance)
+
+        errors.sort()
+        return instances, errors
 
 
 class ConfirmationForm(BootstrapMixin, forms.Form):
@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 from django.conf import settings
 from django.http import HttpResponseRedirect
 
+from .audit import UserActionBuffer
+
 
 class RequireLoginMiddleware(object):
     """
@@ -20,3 +22,17 @@ class RequireLoginMiddleware(object):
                     '{}?next={}'.format(settings.LOGIN_URL, request.path_info))
 
         return self.get_response(request)
+
+
+class UserActionBufferMiddleware(object):
+    """
+    Write the user actions logged while handling a request by batches, at the
+    latest once the response is ready.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with UserActionBuffer(size=settings.USER_ACTION_BUFFER_SIZE):
+            return self.get_response(request)
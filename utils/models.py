@@ -4,8 +4,11 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
+from .audit import get_buffer
+
 
 # User Actions Constants
 USER_ACTION_CREATE = 1
@@ -36,17 +39,42 @@ class CreatedUpdatedModel(models.Model):
 class UserActionManager(models.Manager):
     """
     Manager for UserAction model.
+
+    Actions are written by batches if a buffer is used by the current thread
+    (which is the case while handling a request), otherwise they are written
+    right away.
     """
 
+    def _log(self, user, model, action, message, object_id=None):
+        # Content types are cached by their manager, no query once known
+        user_action = self.model(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=object_id, user=user, action=action, message=message)
+
+        buffer = get_buffer()
+        if buffer is None:
+            user_action.save()
+        else:
+            buffer.add(user_action)
+
+    def _log_objects(self, user, objects, action, message):
+        for obj in objects:
+            self._log(user, obj, action, '{} {} {}'.format(
+                message, obj._meta.verbose_name, escape(obj)), object_id=obj.pk)
+
     def log_action(self, user, obj, action, message):
-        self.model.objects.create(content_type=ContentType.objects.get_for_model(
-            obj), object_id=obj.id, user=user, action=action, message=message)
+        self._log(user, obj, action, message, object_id=obj.id)
 
     def log_bulk_action(self, user, obj_type, action, message):
-        self.model.objects.create(content_type=ContentType.objects.get_for_model(
-            obj_type), user=user, action=action, message=message)
+        self._log(user, obj_type, action, message)
 
-    def log_bulk_delete(self, user, obj_type, message):
+    def log_bulk_delete(self, user, obj_type, message, objects=None):
+        """
+        Logs the deletion of several objects. If the deleted objects are
+        given, the deletion of each one of them is also logged.
+        """
+        if objects:
+            self._log_objects(user, objects, USER_ACTION_DELETE, 'Deleted')
         self.log_bulk_action(user, obj_type, USER_ACTION_BULK_DELETE, message)
 
     def log_create(self, user, obj, message):
@@ -58,7 +86,13 @@ class UserActionManager(models.Manager):
     def log_edit(self, user, obj, message):
         self.log_action(user, obj, USER_ACTION_EDIT, message)
 
-    def log_import(self, user, obj_type, message):
+    def log_import(self, user, obj_type, message, objects=None):
+        """
+        Logs the import of several objects. If the imported objects are given,
+        the creation of each one of them is also logged.
+        """
+        if objects:
+            self._log_objects(user, objects, USER_ACTION_CREATE, 'Created')
         self.log_bulk_action(user, obj_type, USER_ACTION_IMPORT, message)
 
 
@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
 
+import base64
+import hashlib
+import json
+import math
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
 from django.core.paginator import Paginator, Page
+from django.db.models import Q
+from django.utils.functional import cached_property
 
 
 class EnhancedPaginator(Paginator):
@@ -35,3 +44,157 @@ class EnhancedPage(Page):
             pages_list.insert(pages_list.index(i), False)
 
         return pages_list
+
+
+class KeysetPaginator(object):
+    """
+    Paginator finding the objects of a page using the values of the ordering
+    fields of the last (or first) object of the previous (or next) page
+    instead of an offset. The cost of a page does not depend on how deep it
+    is. Pages are identified by cursors encoding these values.
+
+    The ordering of the queryset must be made of non-nullable fields (not
+    relations), it is completed with the primary key so that it is
+    deterministic. The total number of objects is cached for a while,
+    which makes it an approximate count.
+    """
+    keyset = True
+
+    def __init__(self, queryset, per_page, count_timeout=60):
+        # The number of objects per page usually comes from the request
+        try:
+            per_page = int(per_page)
+        except (TypeError, ValueError):
+            per_page = 0
+        if per_page < 1:
+            per_page = getattr(settings, 'PAGINATE_COUNT', 20)
+
+        ordering = list(queryset.query.order_by or
+                        queryset.model._meta.ordering)
+        if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+            ordering.append('pk')
+
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def count(self):
+        try:
+            query = str(self.queryset.query)
+        except EmptyResultSet:
+            return 0
+
+        key = 'keyset_paginator_count_{}'.format(
+            hashlib.sha1(query.encode()).hexdigest())
+        return cache.get_or_set(key, self.queryset.count, self.count_timeout)
+
+    @cached_property
+    def num_pages(self):
+        return max(1, int(math.ceil(self.count / float(self.per_page))))
+
+    def _get_values(self, obj):
+        values = []
+        for field in self.ordering:
+            value = obj
+            for name in field.lstrip('-').split('__'):
+                value = getattr(value, name)
+            values.append(value)
+
+        return values
+
+    def encode_cursor(self, obj):
+        values = json.dumps(self._get_values(obj), default=str)
+        return base64.urlsafe_b64encode(values.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the values encoded in a cursor, or None if the cursor is not
+        valid.
+        """
+        try:
+            values = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError):
+            return None
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            return None
+
+        return values
+
+    def _get_filter(self, values, forward):
+        # Objects after (or before) the given values in the ordering, for
+        # instance (a > 1) or (a = 1 and b > 2) for an ordering on a and b
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            sub_condition = Q(**{'{}__{}'.format(field.lstrip('-'), lookup):
+                                 values[i]})
+            for previous_field, value in zip(self.ordering[:i], values):
+                sub_condition &= Q(**{previous_field.lstrip('-'): value})
+            condition |= sub_condition
+
+        return condition
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page following the after cursor, or preceding the before
+        cursor. The first page is returned if no valid cursors are given.
+        """
+        queryset = self.queryset
+        forward = True
+        values = self.decode_cursor(after) if after else None
+
+        if values:
+            queryset = queryset.filter(self._get_filter(values, True))
+        elif before:
+            values = self.decode_cursor(before)
+            if values:
+                forward = False
+                queryset = queryset.filter(
+                    self._get_filter(values, False)).reverse()
+
+        # One more object tells if there is another page after this one
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if forward:
+            return KeysetPage(object_list, self, has_next=has_more,
+                              has_previous=bool(values))
+
+        object_list.reverse()
+        return KeysetPage(object_list, self, has_next=True,
+                          has_previous=has_more)
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0])
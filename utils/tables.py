@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 import django_tables2 as tables
 
+from django.core.exceptions import FieldDoesNotExist
 from django.utils.safestring import mark_safe
 
 
@@ -9,6 +10,9 @@ class BaseTable(tables.Table):
     """
     Default table for object lists
     """
+    # Related objects to fetch along with the records, in addition to the ones
+    # found by looking at the column accessors
+    select_related = ()
 
     def __init__(self, *args, **kwargs):
         super(BaseTable, self).__init__(*args, **kwargs)
@@ -18,6 +22,40 @@ class BaseTable(tables.Table):
             self.empty_text = 'No {} found.'.format(
                 self._meta.model._meta.verbose_name_plural)
 
+    @classmethod
+    def get_select_related(cls):
+        """
+        Returns the related objects (following foreign keys) read by the
+        columns of the table, they should be fetched with the records to avoid
+        one query per record.
+        """
+        related = set(cls.select_related)
+        model = cls._meta.model
+        if not model:
+            return related
+
+        for name, column in cls.base_columns.items():
+            accessor = str(column.accessor or name)
+            current_model = model
+            path = []
+
+            for part in accessor.replace('__', '.').split('.'):
+                try:
+                    field = current_model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    break
+
+                if not (field.many_to_one or field.one_to_one):
+                    break
+
+                path.append(part)
+                current_model = field.related_model
+
+            if path:
+                related.add('__'.join(path))
+
+        return related
+
     class Meta:
         attrs = {
             'class': 'table table-sm table-hover table-headings',
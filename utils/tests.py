@@ -1,9 +1,17 @@
 from __future__ import unicode_literals
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from .audit import UserActionBuffer
+from .models import (UserAction, USER_ACTION_CREATE, USER_ACTION_DELETE,
+                     USER_ACTION_BULK_DELETE, USER_ACTION_IMPORT)
+from .paginators import KeysetPaginator
+
 
 class ViewTestCase(TestCase):
     """
@@ -57,6 +65,15 @@ class ViewTestCase(TestCase):
         if notcontains:
             self.assertNotContains(response, notcontains)
 
+    def get_request_query_count(self, path, params={}):
+        """
+        Returns the number of database queries needed by a GET request.
+        """
+        with CaptureQueriesContext(connection) as context:
+            self.get_request(path, params=params)
+
+        return len(context.captured_queries)
+
     def post_request(self, path, params={}, data={}, expected_status_code=200):
         # Perform the POST request
         response = self.client.post(reverse(path, kwargs=params), data=data,
@@ -64,3 +81,126 @@ class ViewTestCase(TestCase):
 
         # Ensure that the status code is the expected one
         self.assertEqual(expected_status_code, response.status_code)
+
+
+class KeysetPaginatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            User.objects.create_user(username='user{}'.format(i))
+        self.queryset = User.objects.order_by('username')
+
+    def get_usernames(self, page):
+        return [user.username for user in page]
+
+    def test_page(self):
+        paginator = KeysetPaginator(self.queryset, 2)
+        self.assertEqual(['username', 'pk'], paginator.ordering)
+        self.assertEqual(5, paginator.count)
+        self.assertEqual(3, paginator.num_pages)
+
+        # Walk forward
+        page = paginator.page()
+        self.assertEqual(['user0', 'user1'], self.get_usernames(page))
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(after=page.next_cursor())
+        self.assertEqual(['user2', 'user3'], self.get_usernames(page))
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(after=page.next_cursor())
+        self.assertEqual(['user4'], self.get_usernames(page))
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+
+        # Walk backward
+        page = paginator.page(before=page.previous_cursor())
+        self.assertEqual(['user2', 'user3'], self.get_usernames(page))
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(before=page.previous_cursor())
+        self.assertEqual(['user0', 'user1'], self.get_usernames(page))
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_page_descending(self):
+        paginator = KeysetPaginator(self.queryset.order_by('-username'), 3)
+
+        page = paginator.page()
+        self.assertEqual(['user4', 'user3', 'user2'],
+                         self.get_usernames(page))
+        page = paginator.page(after=page.next_cursor())
+        self.assertEqual(['user1', 'user0'], self.get_usernames(page))
+        page = paginator.page(before=page.previous_cursor())
+        self.assertEqual(['user4', 'user3', 'user2'],
+                         self.get_usernames(page))
+
+    def test_page_invalid_cursor(self):
+        paginator = KeysetPaginator(self.queryset, 2)
+
+        # Invalid cursors give the first page
+        for cursor in ['invalid', 'WzFd']:
+            page = paginator.page(after=cursor)
+            self.assertEqual(['user0', 'user1'], self.get_usernames(page))
+
+    def test_page_constant_queries(self):
+        paginator = KeysetPaginator(self.queryset, 1)
+        page = paginator.page()
+
+        # Deep pages need as many queries as the first one
+        for _ in range(4):
+            with self.assertNumQueries(1):
+                page = paginator.page(after=page.next_cursor())
+
+
+class UserActionBufferTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test')
+        self.objects = [User.objects.create_user(username='user{}'.format(i))
+                        for i in range(3)]
+
+    def test_log_without_buffer(self):
+        UserAction.objects.log_create(self.user, self.user, 'Created')
+        self.assertEqual(1, UserAction.objects.count())
+
+    def test_log_with_buffer(self):
+        with UserActionBuffer() as buffer:
+            # Content types are already known, nothing is written yet
+            UserAction.objects.log_create(self.user, self.user, 'Created')
+            with self.assertNumQueries(0):
+                UserAction.objects.log_create(self.user, self.user,
+                                              'Created')
+            self.assertEqual(2, len(buffer))
+            self.assertEqual(0, UserAction.objects.count())
+
+        # Written on exit
+        self.assertEqual(2, UserAction.objects.count())
+
+    def test_flush_when_full(self):
+        with UserActionBuffer(size=2) as buffer:
+            for obj in self.objects:
+                UserAction.objects.log_edit(self.user, obj, 'Modified')
+            self.assertEqual(1, len(buffer))
+            self.assertEqual(2, UserAction.objects.count())
+
+        self.assertEqual(3, UserAction.objects.count())
+
+    def test_log_objects(self):
+        with UserActionBuffer():
+            UserAction.objects.log_import(self.user, User, 'Imported 3 users',
+                                          objects=self.objects)
+            UserAction.objects.log_bulk_delete(
+                self.user, User, 'Deleted 3 users', objects=self.objects)
+
+        # Each object and the whole operations are logged
+        actions = UserAction.objects.order_by('pk')
+        self.assertEqual(
+            [USER_ACTION_CREATE] * 3 + [USER_ACTION_IMPORT] +
+            [USER_ACTION_DELETE] * 3 + [USER_ACTION_BULK_DELETE],
+            [action.action for action in actions])
+        self.assertEqual('Created user user0', actions[0].message)
+        self.assertEqual(self.objects[0].pk, actions[0].object_id)
+        self.assertIsNone(actions[3].object_id)
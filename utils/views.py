@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 
+from itertools import islice
+
 from django.conf import settings
 from django.db import transaction
 from django.db.models import ProtectedError
@@ -17,9 +19,12 @@ from django.views.generic import View
 
 from django_tables2 import RequestConfig
 
-from .forms import BootstrapMixin, ConfirmationForm, CSVDataField
+from .db import bulk_create
+from .forms import (BootstrapMixin, ConfirmationForm, CSVDataField,
+                    CSVFileField, CSVRecordValidator, has_custom_validation,
+                    share_formset_choices)
 from .models import UserAction
-from .paginators import EnhancedPaginator
+from .paginators import EnhancedPaginator, KeysetPaginator
 
 
 class AddOrEditView(LoginRequiredMixin, View):
@@ -113,7 +118,66 @@ class AddOrEditView(LoginRequiredMixin, View):
         })
 
 
-class BulkAddFromDependencyView(LoginRequiredMixin, View):
+class FormSetSaveMixin(object):
+    """
+    Saves the objects of the forms of a formset. By default, the forms are
+    validated by batch and their objects are created with as few queries as
+    possible. Forms are validated one by one if the formset defines its own
+    validation, or if bulk_save is set to False.
+    """
+    bulk_save = True
+
+    def bulk_save_formset(self, formset):
+        """
+        Returns the objects created with a bound formset, or None if some forms
+        are not valid.
+        """
+        if not formset.is_bound or not formset.management_form.is_valid():
+            return None
+
+        validator = CSVRecordValidator(self.form_model)
+        records = []
+        for i, form in enumerate(formset.forms):
+            records.append((i, {
+                name: formset.data[form.add_prefix(name)]
+                for name in validator.fields
+                if form.add_prefix(name) in formset.data
+            }))
+
+        instances, errors = validator.validate(records)
+        if errors:
+            return None
+
+        with transaction.atomic():
+            bulk_create(self.form_model._meta.model, instances)
+
+        return instances
+
+    def save_formset(self, formset):
+        """
+        Returns the objects created with the formset, or None if it is not
+        valid.
+        """
+        if self.bulk_save and not has_custom_validation(type(formset)):
+            new_objects = self.bulk_save_formset(formset)
+            if new_objects is not None:
+                return new_objects
+
+        # Validate the forms one by one to get their errors
+        if not formset.is_valid():
+            return None
+
+        new_objects = []
+        with transaction.atomic():
+            for form in formset:
+                if form.is_valid():
+                    new_objects.append(form.save())
+
+        return new_objects
+
+
+class BulkAddFromDependencyView(FormSetSaveMixin, LoginRequiredMixin,
+                                View):
     model = None
     dependency_model = None
     custom_formset = None
@@ -130,6 +194,12 @@ class BulkAddFromDependencyView(LoginRequiredMixin, View):
     def process_dependency_object(self, dependency):
         return None
 
+    def process_dependency_objects(self, dependencies):
+        # Process all dependencies at once, can be overridden to avoid
+        # processing them one by one
+        return [self.process_dependency_object(dependency)
+                for dependency in dependencies]
+
     def sort_objects(self, object_list):
         return []
 
@@ -170,34 +240,25 @@ class BulkAddFromDependencyView(LoginRequiredMixin, View):
             formset = ObjectFormSet(data=request.POST)
         else:
             # Proceed dependencies and fill in the form
-            dependencies_processing_result = []
-            for dependency in dependencies:
-                dependencies_processing_result.append(
-                    self.process_dependency_object(dependency))
-
             formset = ObjectFormSet(initial=self.sort_objects(
-                dependencies_processing_result))
-
-        new_objects = []
-        if formset.is_valid():
-            with transaction.atomic():
-                for form in formset:
-                    if form.is_valid():
-                        instance = form.save()
-                        new_objects.append(instance)
+                self.process_dependency_objects(dependencies)))
 
+        new_objects = self.save_formset(formset)
+        if new_objects is not None:
             if new_objects:
                 # Notify user of successful import
                 message = 'Imported {} {}'.format(
                     len(new_objects), new_objects[0]._meta.verbose_name_plural)
                 messages.success(request, message)
 
-                # Log the import action
+                # Log the import action, once for all objects
                 UserAction.objects.log_import(
                     request.user, self.form_model._meta.model, message)
 
             return redirect(self.get_return_url())
 
+        # Render select fields without one query per form
+        share_formset_choices(formset)
         return render(request, self.template, {
             'formset': formset,
             'obj_type': self.form_model._meta.model._meta.verbose_name,
@@ -250,6 +311,8 @@ class BulkDeleteView(LoginRequiredMixin, View):
             form = form_model(request.POST)
             if form.is_valid():
                 queryset = self.model.objects.filter(pk__in=pk_list)
+                # Keep the objects to log their deletions
+                deleted_objects = list(queryset)
 
                 try:
                     deleted_count = queryset.delete(
@@ -262,7 +325,8 @@ class BulkDeleteView(LoginRequiredMixin, View):
                     deleted_count, self.model._meta.verbose_name_plural)
                 messages.success(request, message)
                 UserAction.objects.log_bulk_delete(
-                    request.user, self.model, message)
+                    request.user, self.model, message,
+                    objects=deleted_objects)
 
                 return redirect(self.return_url)
         else:
@@ -446,12 +510,23 @@ class ImportView(LoginRequiredMixin, View):
     form_model = None
     return_url = None
     template = 'utils/object_import.html'
+    # Number of records of an uploaded file validated and created at once
+    batch_size = 500
+    # Stop reading an uploaded file once this number of errors is reached
+    max_errors = 50
 
     def import_form(self, *args, **kwargs):
         fields = self.form_model().fields.keys()
 
         class ImportForm(BootstrapMixin, Form):
-            csv = CSVDataField(fields=fields)
+            csv = CSVDataField(fields=fields, required=False)
+            csv_file = CSVFileField(fields=fields, required=False)
+
+            def clean(self):
+                if not self.cleaned_data.get('csv') and \
+                        not self.cleaned_data.get('csv_file'):
+                    raise ValidationError(
+                        'CSV data or a CSV file must be given.')
 
         return ImportForm(*args, **kwargs)
 
@@ -466,14 +541,75 @@ class ImportView(LoginRequiredMixin, View):
             'return_url': self.return_url,
         })
 
+    def import_file(self, form):
+        """
+        Creates objects from the records of the uploaded file, reading,
+        validating and creating them by batches. Returns the number of created
+        objects, nothing is created if a record is invalid.
+        """
+        model = self.form_model._meta.model
+        validator = CSVRecordValidator(self.form_model)
+        field = form.fields['csv_file']
+        errors = 0
+        created = 0
+
+        with transaction.atomic():
+            try:
+                records = field.records(form.cleaned_data['csv_file'])
+                while errors < self.max_errors:
+                    batch = list(islice(records, self.batch_size))
+                    if not batch:
+                        break
+
+                    instances, batch_errors = validator.validate(batch)
+                    for row, name, error in batch_errors[
+                            :self.max_errors - errors]:
+                        form.add_error('csv_file', 'Row {} {}: {}'.format(
+                            row, name, error))
+                    errors += len(batch_errors)
+
+                    # Keep on validating to report errors, but do not bother
+                    # creating objects that will not be kept
+                    if not errors:
+                        bulk_create(model, instances)
+                        created += len(instances)
+            except ValidationError as e:
+                form.add_error('csv_file', e)
+                errors += 1
+            except UnicodeDecodeError:
+                form.add_error('csv_file', 'The file is not UTF-8 encoded.')
+                errors += 1
+
+            if errors:
+                transaction.set_rollback(True)
+                return 0
+
+        return created
+
     def post(self, request, *args, **kwargs):
         """
         The form has been submitted, process it.
         """
         new_objects = []
-        form = self.import_form(request.POST)
+        form = self.import_form(request.POST, request.FILES)
 
-        if form.is_valid():
+        if form.is_valid() and form.cleaned_data['csv_file']:
+            created = self.import_file(form)
+
+            if created:
+                # Notify user of successful import
+                message = 'Imported {} {}'.format(
+                    created,
+                    self.form_model._meta.model._meta.verbose_name_plural)
+                messages.success(request, message)
+
+                # Log the import action, not each object since the file can
+                # be huge
+                UserAction.objects.log_import(
+                    request.user, self.form_model._meta.model, message)
+
+                return redirect(self.return_url)
+        elif form.is_valid():
             try:
                 with transaction.atomic():
                     for row, data in enumerate(form.cleaned_data['csv'], start=1):
@@ -499,7 +635,8 @@ class ImportView(LoginRequiredMixin, View):
 
                     # Log the import action
                     UserAction.objects.log_import(
-                        request.user, self.form_model._meta.model, message)
+                        request.user, self.form_model._meta.model, message,
+                        objects=new_objects)
 
                     return redirect(self.return_url)
             except ValidationError:
@@ -519,6 +656,11 @@ class ModelListView(View):
     filter_form = None
     table = None
     template = None
+    # Related objects to fetch along with the ones needed by the table
+    select_related = ()
+    # Find pages using the ordering of the queryset instead of an offset, the
+    # cost of a page does not depend on how deep it is
+    keyset_pagination = False
 
     def build_queryset(self, request, kwargs):
         return self.queryset
@@ -538,8 +680,9 @@ class ModelListView(View):
                 table.columns.show('actions')
 
     def get(self, request, *args, **kwargs):
-        # If no query set has been provided for some reasons
-        if not self.queryset:
+        # If no query set has been provided for some reasons (do not use the
+        # queryset as a boolean, it would fetch all its objects)
+        if self.queryset is None:
             self.queryset = self.build_queryset(request, kwargs)
 
         # If there is a filter, apply it
@@ -549,16 +692,41 @@ class ModelListView(View):
         # Alter the queryset if needed
         self.queryset = self.alter_queryset(request)
 
-        # Build the table based on the queryset
-        table = self.table(self.queryset)
-        self.setup_table_columns(request, table, kwargs)
+        # Fetch related objects with the same query instead of one query per
+        # row
+        select_related = set(self.select_related)
+        if hasattr(self.table, 'get_select_related'):
+            select_related.update(self.table.get_select_related())
+        if select_related:
+            self.queryset = self.queryset.select_related(
+                *sorted(select_related))
+
+        per_page = request.GET.get('per_page', settings.PAGINATE_COUNT)
+
+        # Sorting the table by another column is only possible with the
+        # regular pagination
+        if (self.keyset_pagination and
+                self.table._meta.order_by_field not in request.GET):
+            paginator = KeysetPaginator(self.queryset, per_page)
+            page = paginator.page(after=request.GET.get('after'),
+                                  before=request.GET.get('before'))
+
+            # Build the table based on the objects of the page only
+            table = self.table(page.object_list)
+            self.setup_table_columns(request, table, kwargs)
+            RequestConfig(request, paginate=False).configure(table)
+            table.keyset_page = page
+        else:
+            # Build the table based on the queryset
+            table = self.table(self.queryset)
+            self.setup_table_columns(request, table, kwargs)
 
-        # Apply pagination
-        paginate = {
-            'klass': EnhancedPaginator,
-            'per_page': request.GET.get('per_page', settings.PAGINATE_COUNT)
-        }
-        RequestConfig(request, paginate).configure(table)
+            # Apply pagination
+            paginate = {
+                'klass': EnhancedPaginator,
+                'per_page': per_page,
+            }
+            RequestConfig(request, paginate).configure(table)
 
         # Set context and render
         context = {
@@ -571,7 +739,7 @@ class ModelListView(View):
         return render(request, self.template, context)
 
 
-class TableImportView(LoginRequiredMixin, View):
+class TableImportView(FormSetSaveMixin, LoginRequiredMixin, View):
     custom_formset = None
     form_model = None
     return_url = None
@@ -606,6 +774,8 @@ class TableImportView(LoginRequiredMixin, View):
             messages.info(request, 'No data to import.')
             return redirect(self.get_return_url())
 
+        # Render select fields without one query per form
+        share_formset_choices(formset)
         return render(request, self.template, {
             'formset': formset,
             'obj_type': self.form_model._meta.model._meta.verbose_name,
@@ -622,27 +792,23 @@ class TableImportView(LoginRequiredMixin, View):
             ObjectFormSet = formset_factory(
                 self.form_model, formset=self.custom_formset, extra=0)
         formset = ObjectFormSet(request.POST)
-        new_objects = []
-
-        if formset.is_valid():
-            with transaction.atomic():
-                for form in formset:
-                    if form.is_valid():
-                        instance = form.save()
-                        new_objects.append(instance)
 
+        new_objects = self.save_formset(formset)
+        if new_objects is not None:
             if new_objects:
                 # Notify user of successful import
                 message = 'Imported {} {}'.format(
                     len(new_objects), new_objects[0]._meta.verbose_name_plural)
                 messages.success(request, message)
 
-                # Log the import action
+                # Log the import action, once for all objects
                 UserAction.objects.log_import(
                     request.user, self.form_model._meta.model, message)
 
             return redirect(self.get_return_url())
 
+        # Render select fields without one query per form
+        share_formset_choices(formset)
         return render(request, self.template, {
             'formset': formset,
             'obj_type': self.form_model._meta.model._meta.verbose_name,